@@ -3,19 +3,23 @@ import uuid
 import base64
 from pathlib import Path
 
-from flask import Flask, session, abort, url_for, redirect, render_template, jsonify, send_file
+from flask import Flask, session, abort, url_for, redirect, render_template, jsonify
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import Forbidden, NotFound
 from jinja2 import TemplateNotFound
+from rq.job import Job, JobStatus
+from rq.exceptions import NoSuchJobError
+from rq.utils import utcnow
 
-from common import VERSION, history
+from common import VERSION, history, results, expiry, scheduling
 from web import settings
 from web import forms
 from web import utils
+from web import images
 
 
 app = Flask(__name__)
-app, auth, limiter, auth_limit, job_queue = settings.configure(app)
+app, auth, limiter, auth_limit, redis_client, job_queues = settings.configure(app)
 
 
 def get_session_id(create=False):
@@ -31,10 +35,13 @@ def get_job_or_abort(job_id):
     session_id = get_session_id()
     if session_id is None:
         abort(403)
-    job = job_queue.fetch_job(job_id)
-    if job is None:
+    try:
+        job = Job.fetch(job_id, connection=redis_client)
+    except NoSuchJobError:
+        abort(404)
+    if job.origin not in job_queues:
         abort(404)
-    if job.meta['session_id'] != session_id:
+    if job.meta.get('session_id') != session_id:
         abort(404 if settings.PREVENT_JOB_PROBING else 403)
     return job
 
@@ -43,10 +50,11 @@ def get_job_or_abort(job_id):
 def index():
     form = forms.UploadForm()
     if form.validate_on_submit():
+        model = form.model.data
+        job_queue = job_queues[settings.MODEL_QUEUES[model]]
         if job_queue.count >= settings.get_max_queue_size(job_queue):
             return render_template('errors/busy.html')
 
-        model = form.model.data
         with limiter.limit(settings.RATE_LIMITS[model]):
             content_image = form.content_image.data
             style_image = form.style_image.data
@@ -58,17 +66,43 @@ def index():
             job_dir = settings.get_jobs_dir(app) / job_id
             content_filename = Path(secure_filename(content_image.filename))
             style_filename = secure_filename(style_image.filename)
-            result_filename = f'{content_filename.stem} (stylized).{settings.RESULT_FORMAT[0]}'
+            result_filename = f'{content_filename.stem} (stylized).{settings.RESULT_FORMAT}'
+            job_kwargs = settings.JOB_KWARGS[model]
+            expiry.schedule(job_queue.connection, job_id, expiry.get_max_ttl(job_kwargs))
             job_dir.mkdir(parents=True, exist_ok=True)
-            content_image.save(job_dir / content_filename)
-            style_image.save(job_dir / style_filename)
 
             func = {'fast': 'fast_style_transfer', 'iterative': 'iterative_style_transfer'}[model]
             args = job_id, str(content_filename), style_filename, strength, result_filename
             meta = {'session_id': session_id}
-            job_queue.enqueue(f'worker.tasks.{func}', description=func, args=args, job_id=job_id, meta=meta,
-                **settings.JOB_KWARGS[model])
-            app.logger.info('Enqueued job: %s', job_id)
+            result_key = results.get_key([content_image.stream, style_image.stream], model, strength,
+                settings.RESULT_FORMAT)
+            result_path = results.lookup(job_queue.connection, result_key)
+            if result_path is not None and utils.link_result(settings.get_jobs_dir(app) / result_path,
+                    job_dir / result_filename):
+                job = job_queue.create_job(f'worker.tasks.{func}', description=func, args=args, job_id=job_id,
+                    meta=meta, status=JobStatus.FINISHED, timeout=job_kwargs['job_timeout'],
+                    result_ttl=job_kwargs['result_ttl'], ttl=job_kwargs['ttl'], failure_ttl=job_kwargs['failure_ttl'])
+                job.ended_at = utcnow()
+                with job_queue.connection.pipeline() as pipeline:
+                    job.save(pipeline=pipeline)
+                    job.cleanup(ttl=job.result_ttl, pipeline=pipeline, remove_from_queue=False)
+                    job_queue.finished_job_registry.add(job, job.result_ttl, pipeline=pipeline)
+                    pipeline.execute()
+                app.logger.info('Reused result for job: %s', job_id)
+            else:
+                content_image.save(job_dir / content_filename)
+                style_image.save(job_dir / style_filename)
+                meta['result_key'] = result_key
+                _, (width, height) = images.get_image_dimensions(content_image.stream)
+                cost = scheduling.get_cost(model, width, height, settings.get_time_per_mp())
+                job_queue.register_job(job_id, session_id, cost)
+                try:
+                    job_queue.enqueue(f'worker.tasks.{func}', description=func, args=args, job_id=job_id, meta=meta,
+                        **job_kwargs)
+                except Exception:
+                    job_queue.unregister_job(job_id, refund=True)  # give the session its share back
+                    raise
+                app.logger.info('Enqueued job: %s', job_id)
 
             redirect_url = url_for('result', job_id=job_id)
             return redirect(redirect_url)
@@ -87,7 +121,9 @@ def status(job_id):
     status = job.get_status(refresh=False)
     fields = {'status': status}
     if status == 'queued':
-        fields['position'] = job_queue.get_job_position(job)
+        fields['position'], fields['eta'] = settings.get_job_estimate(job_queues, job)
+    elif status == 'started':
+        fields['progress'] = job.meta.get('progress')
     app.logger.info('Job status: %s', status)
     return jsonify(fields), 200
 
@@ -97,7 +133,11 @@ def cancel(job_id):
     form = forms.CancelForm()
     if form.validate_on_submit():
         job = get_job_or_abort(job_id)
+        queued = job.get_status(refresh=False) == JobStatus.QUEUED
         job.cancel()
+        job_queue = job_queues.get(job.origin)
+        if job_queue is not None:
+            job_queue.unregister_job(job.id, refund=queued)
         app.logger.info('Canceled job: %s', job_id)
     return redirect(url_for('index'))
 
@@ -106,12 +146,13 @@ def cancel(job_id):
 def result(job_id):
     job = get_job_or_abort(job_id)
     status = job.get_status(refresh=False)
-    position = job_queue.get_job_position(job) if status == 'queued' else None
+    position, eta = settings.get_job_estimate(job_queues, job) if status == 'queued' else (None, None)
+    progress = job.meta.get('progress') if status == 'started' else None
     filename = job.args[-1]
     cancel_form = forms.CancelForm()
     update_timeout = job.ttl + job.timeout
-    return render_template('result.html', status=status, position=position, filename=filename, cancel_form=cancel_form,
-        update_timeout=update_timeout)
+    return render_template('result.html', status=status, position=position, eta=eta, progress=progress,
+        filename=filename, cancel_form=cancel_form, update_timeout=update_timeout)
 
 
 @app.route('/x/<job_id>/<path:filename>')
@@ -122,7 +163,17 @@ def image(job_id, filename):
     if filename != job.args[-1]:
         abort(404)
     path = settings.get_jobs_dir(app) / job.args[0] / filename
-    return send_file(path, mimetype=settings.RESULT_FORMAT[1])
+    return utils.send_image(path, download_name=filename)
+
+
+@app.route('/x/<job_id>/thumbnail/')
+def thumbnail(job_id):
+    job = get_job_or_abort(job_id)
+    if job.get_status(refresh=False) != 'finished':
+        abort(404)
+    filename = job.args[-1]
+    path = settings.get_jobs_dir(app) / job.args[0] / filename
+    return utils.send_image(path, download_name=filename, thumbnail=True)
 
 
 @app.route('/<path:name>.html')
@@ -135,14 +186,14 @@ def page(name):
 
 @app.route('/status/')
 def server_status():
-    return '', 200 if utils.check_health(app, job_queue) else 503
+    return '', 200 if utils.check_health(app, job_queues) else 503
 
 
 @app.route('/admin/')
 @auth_limit
 @auth.login_required
 def admin():
-    status = utils.check_health(app, job_queue)
+    status = utils.check_health(app, job_queues)
     return render_template('admin/admin.html', version=VERSION, status=status)
 
 
@@ -150,8 +201,12 @@ def admin():
 @auth_limit
 @auth.login_required
 def stats():
-    job_stats = history.get_job_stats(settings.get_db())
-    return render_template('admin/stats.html', job_stats=job_stats)
+    db = settings.get_db()
+    job_stats = history.get_job_stats(db)
+    timing_stats = history.get_timing_percentiles(db)
+    result_stats = results.get_stats(redis_client)
+    return render_template('admin/stats.html', job_stats=job_stats, timing_stats=timing_stats,
+        timing_phases=history.PHASES, result_stats=result_stats)
 
 
 @app.errorhandler(400)
@@ -0,0 +1,111 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+from pathlib import Path
+
+from PIL import Image
+
+from worker import images
+from .models import load_pipeline
+from .precision import get_psnr
+from .utils import reset_peak_rss, get_peak_rss, get_rss, make_image
+
+
+BACKENDS = ['tf', 'tflite', 'tflite-fp16', 'tflite-int8']
+SIZES = [256, 512]
+NUM_PAIRS = 3
+REPEAT = 5
+MIN_PSNR = 30
+
+
+def run_backend(backend, threads, offline, pairs, sizes, repeat, tmp_dir):
+    os.environ['FAST_BACKEND'] = backend
+    reset_peak_rss()
+    start_time = time.perf_counter()
+    fast, versions, models = load_pipeline('fast', threads, offline)
+    load_time = time.perf_counter() - start_time
+    load_rss = get_rss()
+    if fast.backend.name != backend:
+        raise RuntimeError(f'Failed to load the {backend} backend.')
+
+    results = []
+    for size in sizes:
+        for i, (content_path, style_path) in enumerate(pairs):
+            content_image = images.load_image(content_path, size)
+            style_image = images.load_image(style_path, size)
+            times = []
+            for _ in range(repeat + 1):  # the first run warms up and resizes the interpreters
+                fast.style_cache.memory.clear()
+                start_time = time.perf_counter()
+                output = fast.style_transfer(content_image, style_image, 100)[0]
+                times.append(time.perf_counter() - start_time)
+            path = Path(tmp_dir) / f'{backend}_{size}_{i}.png'
+            output.save(path)
+            results.append({'size': size, 'pair': i, 'time': statistics.median(times[1:]), 'output': str(path)})
+    return {'load_time': load_time, 'load_rss_mb': load_rss, 'peak_rss_mb': get_peak_rss(), 'versions': versions,
+        'models': models, 'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency, memory and output quality of the fast model backends '
+        '(linux only).')
+    parser.add_argument('-b', '--backends', nargs='+', choices=BACKENDS, default=BACKENDS)
+    parser.add_argument('-s', '--sizes', nargs='+', type=int, default=SIZES, help='max image sizes')
+    parser.add_argument('-t', '--threads', type=int, default=os.cpu_count())
+    parser.add_argument('-n', '--pairs', type=int, default=NUM_PAIRS, help='number of generated pairs')
+    parser.add_argument('-r', '--repeat', type=int, default=REPEAT)
+    parser.add_argument('--min-psnr', type=float, default=MIN_PSNR, help='fail below this psnr against tf')
+    parser.add_argument('--offline', action='store_true', help='use a stand-in model even if the model is cached')
+    parser.add_argument('-o', '--output', help='write results as json to this file')
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')  # fresh process per backend for a clean rss and import time
+    report = {'meta': {'cpu_count': os.cpu_count(), 'threads': args.threads, 'repeat': args.repeat,
+        'min_psnr': args.min_psnr}, 'backends': {}, 'results': []}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pairs = []
+        for i in range(args.pairs):
+            pair = Path(tmp_dir) / f'{i}_content.jpg', Path(tmp_dir) / f'{i}_style.jpg'
+            make_image(pair[0], 'JPEG', 0.5, seed=2 * i)
+            make_image(pair[1], 'JPEG', 0.5, seed=2 * i + 1)
+            pairs.append(pair)
+
+        references = {}
+        for backend in ['tf'] + [b for b in args.backends if b != 'tf']:
+            run_args = backend, args.threads, args.offline, pairs, args.sizes, args.repeat, tmp_dir
+            # the first load converts the model, so time a second one that finds the conversion cached; the
+            # stand-in's conversions are not cached, and then the timed load includes the conversion
+            with ctx.Pool(1) as pool:
+                output = pool.apply(run_backend, run_args)
+            if backend != 'tf' and output['models']['hub_model'] == 'hub':
+                with ctx.Pool(1) as pool:
+                    output = pool.apply(run_backend, run_args)
+            results = output.pop('results')
+            report['backends'][backend] = output
+            print(f'{backend:12} load {output["load_time"]:6.2f} s  load rss {output["load_rss_mb"]:7.1f} MB  '
+                f'peak rss {output["peak_rss_mb"]:7.1f} MB', file=sys.stderr)
+            for result in results:
+                key = result['size'], result['pair']
+                reference = references.setdefault(key, result)
+                with Image.open(reference['output']) as a, Image.open(result['output']) as b:
+                    result['psnr'] = get_psnr(a, b)
+                result['speedup'] = reference['time'] / result['time']
+                result['ok'] = backend == 'tf' or result['psnr'] >= args.min_psnr
+                report['results'].append({'backend': backend, **{k: v for k, v in result.items() if k != 'output'}})
+                print(f'{backend:12} size {result["size"]:4} pair {result["pair"]}  {result["time"] * 1000:8.1f} ms  '
+                    f'speedup {result["speedup"]:5.2f}  psnr {result["psnr"]:6.1f} dB  '
+                    f'{"ok" if result["ok"] else "FAIL"}', file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    sys.exit(0 if all(result['ok'] for result in report['results']) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+from worker import images
+from .models import load_pipeline
+from .utils import make_image
+
+
+PARAMETRIZATIONS = {
+    'pixels': {'USE_FOURIER': False},
+    'fourier': {'USE_FOURIER': True},
+}
+SIZE = 256
+STEPS = 320
+TARGETS = [0.5, 0.75, 1]  # fractions of the pixel run's steps, whose loss is the target
+STRENGTH = 75
+
+
+def run_parametrization(iterative, settings, content, style_targets, steps):
+    import torch
+    for name, value in settings.items():
+        setattr(iterative, name, value)
+    iterative.NUM_STEPS = steps
+    iterative.CONVERGENCE_MIN_STEPS = steps  # run the full budget, the targets are checked afterwards
+    curve = []
+    times = []
+    start_time = time.perf_counter()
+
+    def progress(info):
+        curve.append(info['content_loss'] + info['style_loss'] + info['tv_loss'])
+        times.append(time.perf_counter() - start_time)
+
+    torch.manual_seed(0)  # the same starting noise for every parametrization
+    style_weight = iterative.MAX_STYLE_WEIGHT * STRENGTH / 100
+    iterative.run_style_transfer(content, style_targets, iterative.CONTENT_WEIGHT, style_weight, iterative.TV_WEIGHT,
+        progress=progress)
+    return curve, times
+
+
+def get_steps_to_target(curve, target):
+    best = float('inf')
+    for step, loss in enumerate(curve, 1):
+        best = min(best, loss)
+        if best <= target:
+            return step
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Steps to reach the loss of the pixel parametrization, for each '
+        'iterative image parametrization.')
+    parser.add_argument('-p', '--parametrizations', nargs='+', choices=PARAMETRIZATIONS, default=list(PARAMETRIZATIONS))
+    parser.add_argument('--content', help='content image (default: generated)')
+    parser.add_argument('--style', help='style image (default: generated)')
+    parser.add_argument('-t', '--threads', type=int, default=os.cpu_count())
+    parser.add_argument('-s', '--size', type=int, default=SIZE, help='max image size')
+    parser.add_argument('--steps', type=int, default=STEPS, help='step budget of every run')
+    parser.add_argument('--targets', nargs='+', type=float, default=TARGETS,
+        help='fractions of the pixel run, whose best loss at that step is a target')
+    parser.add_argument('--offline', action='store_true', help='use random weights even if the model is cached')
+    parser.add_argument('-o', '--output', help='write results as json to this file')
+    args = parser.parse_args()
+
+    iterative, versions, models = load_pipeline('iterative', args.threads, args.offline)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        content_path = args.content or Path(tmp_dir) / 'content.jpg'
+        style_path = args.style or Path(tmp_dir) / 'style.jpg'
+        if not args.content:
+            make_image(content_path, 'JPEG', 0.5, seed=0)
+        if not args.style:
+            make_image(style_path, 'JPEG', 0.5, seed=1)
+        content = iterative.convert_image(images.load_image(content_path, args.size)).unsqueeze(0)
+        style = iterative.convert_image(images.load_image(style_path, args.size)).unsqueeze(0)
+    style_targets = iterative.get_style_targets(style)
+
+    runs = {name: run_parametrization(iterative, PARAMETRIZATIONS[name], content, style_targets, args.steps)
+        for name in ['pixels'] + [p for p in args.parametrizations if p != 'pixels']}
+    pixel_curve, _ = runs['pixels']
+    targets = [min(pixel_curve[:max(round(f * len(pixel_curve)), 1)]) for f in args.targets]
+    results = []
+    for name, (curve, times) in runs.items():
+        for fraction, target in zip(args.targets, targets):
+            steps = get_steps_to_target(curve, target)
+            result = {'parametrization': name, 'target_fraction': fraction, 'target_loss': target, 'steps': steps,
+                'time': times[steps - 1] if steps else None, 'final_loss': min(curve)}
+            results.append(result)
+            steps_text = f'{steps:4} steps {result["time"]:7.1f} s' if steps else ' not reached    '
+            print(f'{name:10} target {fraction:4.2f} ({target:.3e})  {steps_text}  best loss {min(curve):.3e}',
+                file=sys.stderr)
+
+    if args.output:
+        report = {'meta': {'versions': versions, 'models': models, 'size': args.size, 'steps': args.steps},
+            'curves': {name: curve for name, (curve, _) in runs.items()}, 'results': results}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
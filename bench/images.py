@@ -0,0 +1,74 @@
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+from pathlib import Path
+
+from PIL import Image
+
+from worker import images
+from .utils import get_rss, reset_peak_rss, get_peak_rss, make_image
+
+
+SIZES_MP = [1, 4, 12, 25]
+FORMATS = ['JPEG', 'PNG']
+MAX_SIZES = [400, 512]
+REPEAT = 5
+
+
+def load_image_full(image_path, max_size):
+    # the decode path before reduced-resolution decoding
+    image = Image.open(image_path).convert('RGB')
+    size = images.get_scaled_size(image.size, max_size)
+    if size != image.size:
+        image = image.resize(size, resample=Image.Resampling.BILINEAR)
+    return image
+
+
+LOADERS = {'full': load_image_full, 'reduced': images.load_image}
+
+
+def measure(loader, path, max_size, repeat):
+    reset_peak_rss()
+    base_rss = get_rss()
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        LOADERS[loader](path, max_size)
+        times.append(time.perf_counter() - start_time)
+    return statistics.median(times), get_peak_rss() - base_rss
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark worker image loading (linux only).')
+    parser.add_argument('-o', '--output', help='write results as json to this file')
+    parser.add_argument('-r', '--repeat', type=int, default=REPEAT)
+    args = parser.parse_args()
+
+    results = []
+    ctx = multiprocessing.get_context('spawn')  # fresh process per measurement for a clean peak rss
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for fmt in FORMATS:
+            for mp in SIZES_MP:
+                path = Path(tmp_dir) / f'{mp}mp.{fmt.lower()}'
+                width, height = make_image(path, fmt, mp)
+                for max_size in MAX_SIZES:
+                    for loader in LOADERS:
+                        with ctx.Pool(1) as pool:
+                            latency, rss = pool.apply(measure, (loader, path, max_size, args.repeat))
+                        result = {'format': fmt, 'width': width, 'height': height, 'max_size': max_size,
+                            'loader': loader, 'latency': latency, 'peak_rss_mb': rss}
+                        results.append(result)
+                        print(f'{fmt:4} {width:5}x{height:<5} -> {max_size}  {loader:7}  '
+                            f'{latency * 1000:8.1f} ms  {rss:7.1f} MB', file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
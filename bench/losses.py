@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+from worker import images
+from .models import load_pipeline
+from .precision import get_psnr
+from .utils import make_image
+
+
+SIZE = 400
+STEPS = 50
+PROFILE_STEPS = 5
+STRENGTH = 75
+
+
+class ReferenceLoss:
+    # separate autograd losses, the way the closure computed them before the fused loss
+    def __init__(self, content_targets, style_targets, content_weight, style_weight, tv_weight):
+        self.content_targets = [t.float() for t in content_targets]
+        self.style_targets = style_targets
+        self.weights = content_weight, style_weight, tv_weight
+
+    def __call__(self, image, content_features, style_features):
+        import torch
+        import torch.nn.functional as F
+        from worker import iterative
+        content_weight, style_weight, tv_weight = self.weights
+        content_loss = torch.stack([F.mse_loss(f.float(), t) for f, t in zip(content_features, self.content_targets)])
+        style_loss = torch.stack([F.mse_loss(iterative.gram_matrix(f), t)
+            for f, t in zip(style_features, self.style_targets)])
+        dx = image[:, :, :, 1:] - image[:, :, :, :-1]
+        dy = image[:, :, 1:, :] - image[:, :, :-1, :]
+        tv_loss = torch.sum(torch.abs(dx)) + torch.sum(torch.abs(dy)) / (dx.numel() + dy.numel())
+        return torch.stack([content_loss.sum() * content_weight, style_loss.sum() * style_weight,
+            tv_loss * tv_weight])
+
+
+def run_loss(iterative, loss_class, content, style_targets, steps, profile_steps):
+    import torch
+    from torch.profiler import profile, ProfilerActivity
+    iterative.FusedLoss = loss_class
+    style_weight = iterative.MAX_STYLE_WEIGHT * STRENGTH / 100
+
+    def run(num_steps):
+        torch.manual_seed(0)  # the same starting noise for both losses
+        iterative.NUM_STEPS = num_steps
+        return iterative.run_style_transfer(content, style_targets, iterative.CONTENT_WEIGHT, style_weight,
+            iterative.TV_WEIGHT)
+
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        run(profile_steps)
+    allocations = [e.self_cpu_memory_usage for e in prof.events() if e.self_cpu_memory_usage > 0]
+    start_time = time.perf_counter()
+    output, info = run(steps)
+    run_time = time.perf_counter() - start_time
+    return iterative.to_image(output[0]), {'time': run_time, 'steps': info['steps'],
+        'step_time': run_time / info['steps'], 'allocations_per_step': len(allocations) / profile_steps,
+        'allocated_mb_per_step': sum(allocations) / profile_steps / 1024 / 1024}
+
+
+def check_gradients(iterative, loss_class, content, style_targets):
+    import torch
+    torch.manual_seed(0)
+    image = (torch.rand(content.shape) * iterative.NOISE[0] + iterative.NOISE[1]).requires_grad_(True)
+    content_targets, = iterative.extract_features(content, [iterative.CONTENT_LAYERS])
+    loss_fn = loss_class(content_targets, style_targets, iterative.CONTENT_WEIGHT, iterative.MAX_STYLE_WEIGHT,
+        iterative.TV_WEIGHT)
+    content_features, style_features = iterative.extract_features(image, [iterative.CONTENT_LAYERS,
+        iterative.STYLE_LAYERS])
+    loss_terms = loss_fn(image, content_features, style_features)
+    loss_terms.sum().backward()
+    return loss_terms.detach(), image.grad
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-step time and allocations of the fused iterative loss against '
+        'separate autograd losses.')
+    parser.add_argument('--content', help='content image (default: generated)')
+    parser.add_argument('--style', help='style image (default: generated)')
+    parser.add_argument('-t', '--threads', type=int, default=os.cpu_count())
+    parser.add_argument('-s', '--size', type=int, default=SIZE, help='max image size')
+    parser.add_argument('--steps', type=int, default=STEPS)
+    parser.add_argument('--profile-steps', type=int, default=PROFILE_STEPS, help='steps to count allocations over')
+    parser.add_argument('--offline', action='store_true', help='use random weights even if the model is cached')
+    parser.add_argument('-o', '--output', help='write results as json to this file')
+    args = parser.parse_args()
+
+    iterative, versions, models = load_pipeline('iterative', args.threads, args.offline)
+    fused_loss = iterative.FusedLoss
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        content_path = args.content or Path(tmp_dir) / 'content.jpg'
+        style_path = args.style or Path(tmp_dir) / 'style.jpg'
+        if not args.content:
+            make_image(content_path, 'JPEG', 0.5, seed=0)
+        if not args.style:
+            make_image(style_path, 'JPEG', 0.5, seed=1)
+        content = iterative.convert_image(images.load_image(content_path, args.size)).unsqueeze(0)
+        style = iterative.convert_image(images.load_image(style_path, args.size)).unsqueeze(0)
+    style_targets = iterative.get_style_targets(style)
+
+    (reference_terms, reference_grad), (terms, grad) = [check_gradients(iterative, loss_class, content, style_targets)
+        for loss_class in [ReferenceLoss, fused_loss]]
+    errors = {'loss': ((terms - reference_terms).abs() / reference_terms.abs().clamp(min=1e-12)).max().item(),
+        'grad': ((grad - reference_grad).norm() / reference_grad.norm()).item()}
+    print(f'relative error  loss {errors["loss"]:.2e}  grad {errors["grad"]:.2e}', file=sys.stderr)
+
+    run_loss(iterative, fused_loss, content, style_targets, 2, 1)  # warmup
+    results = {}
+    outputs = {}
+    for name, loss_class in [('reference', ReferenceLoss), ('fused', fused_loss)]:
+        outputs[name], results[name] = run_loss(iterative, loss_class, content, style_targets, args.steps,
+            args.profile_steps)
+        result = results[name]
+        print(f'{name:10} {result["steps"]:4} steps  {result["step_time"] * 1000:8.1f} ms/step  '
+            f'{result["allocations_per_step"]:7.1f} allocations/step  {result["allocated_mb_per_step"]:8.1f} MB/step',
+            file=sys.stderr)
+    speedup = results['reference']['step_time'] / results['fused']['step_time']
+    psnr = get_psnr(outputs['reference'], outputs['fused'])
+    print(f'speedup {speedup:.2f}  psnr {psnr:.1f} dB', file=sys.stderr)
+
+    if args.output:
+        report = {'meta': {'versions': versions, 'models': models, 'size': args.size, 'steps': args.steps,
+            'threads': args.threads}, 'errors': errors, 'results': results, 'speedup': speedup, 'psnr': psnr}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+import os
+import ast
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import functools
+import itertools
+import statistics
+import subprocess
+import multiprocessing
+from pathlib import Path
+from contextlib import contextmanager
+
+from worker import images
+from .utils import reset_peak_rss, get_peak_rss, make_image
+
+
+PIPELINES = ['fast', 'iterative']
+SIZES = [256, 400, 512]
+STEPS = [20]
+INPUT_MP = 4
+STRENGTH = 75
+REPEAT = 1
+PHASES = ['load', 'preprocess', 'model', 'postprocess', 'save']
+
+
+class Timer:
+    def __init__(self):
+        self.times = {}
+
+    @contextmanager
+    def __call__(self, phase):
+        start_time = time.perf_counter()
+        yield
+        self.times[phase] = self.times.get(phase, 0) + time.perf_counter() - start_time
+
+
+def load_pipeline(pipeline, threads, offline):
+    from worker import weights
+
+    if pipeline == 'fast':
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(threads)
+        standin = offline or not weights.is_hub_model_cached()
+        if standin:
+            from worker import cache
+            from .standins import HubModelStandIn
+            weights.get_hub_model = HubModelStandIn
+            cache.CACHE_DIR = Path(tempfile.mkdtemp())  # keep the stand-in's conversions out of the real cache
+        from worker import fast as module
+        versions = {'tensorflow': tf.__version__}
+        models = {'hub_model': 'stand-in' if standin else 'hub', 'backend': module.backend.name}
+    else:
+        import torch
+        torch.set_num_threads(threads)
+        random_weights = offline or not weights.is_vgg_model_cached()
+        if random_weights:
+            weights.get_vgg_model = functools.partial(weights.get_vgg_model, pretrained=False)
+        from worker import iterative as module
+        versions = {'torch': torch.__version__}
+        models = {'vgg_weights': 'random' if random_weights else 'imagenet'}
+
+    return module, versions, models
+
+
+def run_fast(fast, content_image, style_image, steps, timer):
+    import tensorflow as tf
+    with timer('preprocess'):
+        content = fast.to_tensor(content_image)[tf.newaxis, :]
+        style = fast.to_tensor(style_image)[tf.newaxis, :]
+    with timer('model'):
+        backend = fast.backend
+        if backend.transfer_style is not None:
+            output = backend.transfer_style(content, backend.predict_style(style))[0]
+        else:
+            output = backend.model(content, style)[0][0]
+    with timer('postprocess'):
+        image = fast.to_image(fast.blend_images(content[0], output, STRENGTH / 100))
+    return image, {}
+
+
+def run_iterative(iterative, content_image, style_image, steps, timer):
+    iterative.NUM_STEPS = steps
+    with timer('preprocess'):
+        content = iterative.convert_image(content_image).unsqueeze(0)
+        style = iterative.convert_image(style_image).unsqueeze(0)
+    with timer('model'):
+        style_targets = iterative.get_style_targets(style)
+        style_weight = iterative.MAX_STYLE_WEIGHT * STRENGTH / 100
+        output, info = iterative.run_style_transfer(content, style_targets, iterative.CONTENT_WEIGHT, style_weight,
+            iterative.TV_WEIGHT)
+    with timer('postprocess'):
+        image = iterative.to_image(output[0])
+    return image, info
+
+
+RUNNERS = {'fast': run_fast, 'iterative': run_iterative}
+
+
+def run_config(pipeline, threads, offline, settings, cases, content_path, style_path, repeat):
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    reset_peak_rss()
+    start_time = time.perf_counter()
+    module, versions, models = load_pipeline(pipeline, threads, offline)
+    load_time = time.perf_counter() - start_time
+    load_rss = get_peak_rss()
+    for name, value in settings.items():
+        if not hasattr(module, name):
+            raise ValueError(f'Unknown setting for {pipeline}: {name}')
+        setattr(module, name, value)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size, steps in cases:
+            reset_peak_rss()
+            runs = []
+            for _ in range(repeat):
+                timer = Timer()
+                with timer('load'):
+                    content_image = images.load_image(content_path, size)
+                    style_image = images.load_image(style_path, size)
+                image, info = RUNNERS[pipeline](module, content_image, style_image, steps, timer)
+                with timer('save'):
+                    images.save_image(image, Path(tmp_dir) / 'result.png')
+                runs.append(timer.times)
+            phases = {phase: statistics.median(run[phase] for run in runs) for phase in PHASES}
+            results.append({'pipeline': pipeline, 'threads': threads, 'size': size, 'steps': steps,
+                'width': content_image.width, 'height': content_image.height, 'phases': phases,
+                'total': sum(phases.values()), 'peak_rss_mb': get_peak_rss(), 'info': info})
+            print(format_result(results[-1]), file=sys.stderr)
+
+    return {'load_time': load_time, 'load_rss_mb': load_rss, 'versions': versions, 'models': models,
+        'results': results}
+
+
+def get_key(result):
+    return result['pipeline'], result['threads'], result['size'], result['steps']
+
+
+def format_result(result):
+    phases = ' '.join(f'{phase} {result["phases"][phase] * 1000:8.1f}' for phase in PHASES)
+    pipeline, threads, size, steps = get_key(result)
+    return (f'{pipeline:9} threads {threads:2} size {size:4} steps {steps:4}  {phases}  '
+        f'total {result["total"] * 1000:9.1f} ms  rss {result["peak_rss_mb"]:7.1f} MB')
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_settings(settings):
+    parsed = {}
+    for s in settings:
+        name, value = s.split('=', 1)
+        pipeline, name = name.split('.', 1)
+        parsed.setdefault(pipeline, {})[name] = ast.literal_eval(value)
+    return parsed
+
+
+def run(args):
+    settings = parse_settings(args.set)
+    report = {'meta': {'commit': get_git_commit(), 'platform': platform.platform(), 'python': platform.python_version(),
+        'cpu_count': os.cpu_count(), 'input_mp': args.input_mp, 'strength': STRENGTH, 'repeat': args.repeat,
+        'settings': settings}, 'pipelines': {}, 'results': []}
+    ctx = multiprocessing.get_context('spawn')  # fresh process per config for thread settings and a clean peak rss
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        content_path = args.content or Path(tmp_dir) / 'content.jpg'
+        style_path = args.style or Path(tmp_dir) / 'style.jpg'
+        if not args.content:
+            make_image(content_path, 'JPEG', args.input_mp, seed=0)
+        if not args.style:
+            make_image(style_path, 'JPEG', args.input_mp, seed=1)
+        for pipeline in args.pipelines:
+            steps = args.steps if pipeline == 'iterative' else [0]
+            cases = list(itertools.product(args.sizes, steps))
+            for threads in args.threads:
+                with ctx.Pool(1) as pool:
+                    output = pool.apply(run_config, (pipeline, threads, args.offline, settings.get(pipeline, {}), cases,
+                        content_path, style_path, args.repeat))
+                results = output.pop('results')
+                report['pipelines'].setdefault(pipeline, {})[threads] = output
+                report['results'].extend(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = {get_key(r): r for r in json.load(f)['results']}
+    with open(args.other) as f:
+        other = json.load(f)['results']
+    for result in other:
+        base_result = base.get(get_key(result))
+        if base_result is None:
+            continue
+        changes = []
+        for phase in PHASES + ['total']:
+            base_time = base_result['phases'].get(phase) if phase != 'total' else base_result['total']
+            time_ = result['phases'].get(phase) if phase != 'total' else result['total']
+            if base_time:
+                changes.append(f'{phase} {(time_ / base_time - 1) * 100:+6.1f}%')
+        rss = (result['peak_rss_mb'] / base_result['peak_rss_mb'] - 1) * 100
+        pipeline, threads, size, steps = get_key(result)
+        print(f'{pipeline:9} threads {threads:2} size {size:4} steps {steps:4}  {"  ".join(changes)}  rss {rss:+6.1f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of the style transfer pipelines (linux only).')
+    subparsers = parser.add_subparsers(required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmark matrix')
+    run_parser.add_argument('-p', '--pipelines', nargs='+', choices=PIPELINES, default=PIPELINES)
+    run_parser.add_argument('-s', '--sizes', nargs='+', type=int, default=SIZES, help='max image sizes')
+    run_parser.add_argument('-t', '--threads', nargs='+', type=int, default=[os.cpu_count()])
+    run_parser.add_argument('-n', '--steps', nargs='+', type=int, default=STEPS, help='iterative step budgets')
+    run_parser.add_argument('-r', '--repeat', type=int, default=REPEAT)
+    run_parser.add_argument('--input-mp', type=float, default=INPUT_MP, help='size of the generated input images')
+    run_parser.add_argument('--content', help='content image (default: generated)')
+    run_parser.add_argument('--style', help='style image (default: generated)')
+    run_parser.add_argument('--offline', action='store_true', help='use random weights even if models are cached')
+    run_parser.add_argument('--set', action='append', default=[], metavar='PIPELINE.NAME=VALUE',
+        help='override a pipeline module setting, e.g. iterative.USE_PYRAMID=True')
+    run_parser.add_argument('-o', '--output', help='write results as json to this file')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('other')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
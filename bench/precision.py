@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from worker import images
+from .models import load_pipeline
+from .utils import make_image
+
+
+MODES = {
+    'fp32': {},
+    'channels_last': {'USE_CHANNELS_LAST': True},
+    'bf16': {'USE_BF16': True},
+    'channels_last+bf16': {'USE_CHANNELS_LAST': True, 'USE_BF16': True},
+}
+NUM_PAIRS = 3
+SIZE = 256
+STEPS = 50
+MIN_PSNR = 30
+STRENGTH = 75
+
+
+def get_psnr(a, b):
+    mse = np.mean((np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)) ** 2)
+    return float(10 * np.log10(255 ** 2 / mse)) if mse else float('inf')
+
+
+def run_mode(iterative, settings, content_image, style_image, steps):
+    import torch
+    for name in ['USE_CHANNELS_LAST', 'USE_BF16']:
+        setattr(iterative, name, settings.get(name, False))
+    iterative.NUM_STEPS = steps
+    torch.manual_seed(0)  # the same starting noise in every mode
+    content = iterative.convert_image(content_image).unsqueeze(0)
+    style = iterative.convert_image(style_image).unsqueeze(0)
+    start_time = time.perf_counter()
+    style_targets = iterative.get_style_targets(style)
+    style_weight = iterative.MAX_STYLE_WEIGHT * STRENGTH / 100
+    output, info = iterative.run_style_transfer(content, style_targets, iterative.CONTENT_WEIGHT, style_weight,
+        iterative.TV_WEIGHT)
+    return iterative.to_image(output[0]), time.perf_counter() - start_time, info['steps']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Quality and speed of the iterative execution modes against fp32.')
+    parser.add_argument('-m', '--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--images', help='directory of content/style pairs named *_content.* and *_style.* '
+        '(default: generated)')
+    parser.add_argument('-n', '--pairs', type=int, default=NUM_PAIRS, help='number of generated pairs')
+    parser.add_argument('-t', '--threads', type=int, default=os.cpu_count())
+    parser.add_argument('-s', '--size', type=int, default=SIZE, help='max image size')
+    parser.add_argument('--steps', type=int, default=STEPS)
+    parser.add_argument('--min-psnr', type=float, default=MIN_PSNR, help='fail below this psnr against fp32')
+    parser.add_argument('--offline', action='store_true', help='use random weights even if the model is cached')
+    parser.add_argument('-o', '--output', help='write results as json to this file')
+    args = parser.parse_args()
+
+    iterative, versions, models = load_pipeline('iterative', args.threads, args.offline)
+    print(f'bf16 supported: {iterative.is_bf16_supported()}', file=sys.stderr)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.images:
+            contents = sorted(Path(args.images).glob('*_content.*'))
+            pairs = [(p, next(p.parent.glob(p.name.replace('_content.', '_style.', 1).rsplit('.', 1)[0] + '.*')))
+                for p in contents]
+        else:
+            pairs = []
+            for i in range(args.pairs):
+                pair = Path(tmp_dir) / f'{i}_content.jpg', Path(tmp_dir) / f'{i}_style.jpg'
+                make_image(pair[0], 'JPEG', 0.5, seed=2 * i)
+                make_image(pair[1], 'JPEG', 0.5, seed=2 * i + 1)
+                pairs.append(pair)
+        for content_path, style_path in pairs:
+            content_image = images.load_image(content_path, args.size)
+            style_image = images.load_image(style_path, args.size)
+            # the reference run doubles as a warmup, speedups are against the timed fp32 run
+            reference, _, _ = run_mode(iterative, {}, content_image, style_image, args.steps)
+            reference_time = None
+            for mode in ['fp32'] + [m for m in args.modes if m != 'fp32']:
+                output, run_time, steps = run_mode(iterative, MODES[mode], content_image, style_image, args.steps)
+                reference_time = reference_time or run_time
+                result = {'image': content_path.name, 'mode': mode, 'time': run_time, 'steps': steps,
+                    'speedup': reference_time / run_time, 'psnr': get_psnr(reference, output)}
+                result['ok'] = mode == 'fp32' or result['psnr'] >= args.min_psnr
+                results.append(result)
+                print(f'{result["image"]:20} {mode:20} {run_time:7.2f} s  speedup {result["speedup"]:5.2f}  '
+                    f'psnr {result["psnr"]:6.1f} dB  {"ok" if result["ok"] else "FAIL"}', file=sys.stderr)
+
+    if args.output:
+        report = {'meta': {'versions': versions, 'models': models, 'size': args.size, 'steps': args.steps,
+            'min_psnr': args.min_psnr}, 'results': results}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    sys.exit(0 if all(result['ok'] for result in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+from pathlib import Path
+
+from worker import images, slots
+from .models import Timer, load_pipeline, run_iterative
+from .utils import make_image
+
+
+SLOTS = [1, 2, 4]
+JOBS = 8
+SIZE = 256
+STEPS = 20
+INPUT_MP = 1
+
+
+def run_slot(slot, num_slots, iterative, job_queue, result_queue, content_path, style_path, size, steps):
+    slots.pin(slots.get_slot_cpus(slot, num_slots))
+    while job_queue.get() is not None:
+        start_time = time.perf_counter()
+        content_image = images.load_image(content_path, size)
+        style_image = images.load_image(style_path, size)
+        run_iterative(iterative, content_image, style_image, steps, Timer())
+        result_queue.put(time.perf_counter() - start_time)
+
+
+def run(num_slots, iterative, args, content_path, style_path):
+    ctx = multiprocessing.get_context('fork')  # share the loaded model like the worker pool does
+    job_queue, result_queue = ctx.Queue(), ctx.Queue()
+    for _ in range(args.jobs):
+        job_queue.put(True)
+    for _ in range(num_slots):
+        job_queue.put(None)
+    processes = [ctx.Process(target=run_slot, args=(slot, num_slots, iterative, job_queue, result_queue, content_path,
+        style_path, args.size, args.steps)) for slot in range(num_slots)]
+    start_time = time.perf_counter()
+    for process in processes:
+        process.start()
+    latencies = [result_queue.get() for _ in range(args.jobs)]
+    total_time = time.perf_counter() - start_time
+    for process in processes:
+        process.join()
+    return {'slots': num_slots, 'threads_per_slot': len(slots.get_slot_cpus(0, num_slots)), 'total_time': total_time,
+        'jobs_per_hour': args.jobs / total_time * 3600, 'latency_p50': statistics.median(latencies),
+        'latency_max': max(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput of concurrent iterative jobs by number of worker slots.')
+    parser.add_argument('-n', '--slots', nargs='+', type=int, default=SLOTS)
+    parser.add_argument('-j', '--jobs', type=int, default=JOBS, help='jobs per configuration')
+    parser.add_argument('-s', '--size', type=int, default=SIZE, help='max image size')
+    parser.add_argument('--steps', type=int, default=STEPS)
+    parser.add_argument('--input-mp', type=float, default=INPUT_MP, help='size of the generated input images')
+    parser.add_argument('--offline', action='store_true', help='use random weights even if the model is cached')
+    parser.add_argument('-o', '--output', help='write results as json to this file')
+    args = parser.parse_args()
+
+    # one thread in the parent, like slots.preload in the worker pool
+    iterative, versions, models = load_pipeline('iterative', 1, args.offline)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        content_path, style_path = Path(tmp_dir) / 'content.jpg', Path(tmp_dir) / 'style.jpg'
+        make_image(content_path, 'JPEG', args.input_mp, seed=0)
+        make_image(style_path, 'JPEG', args.input_mp, seed=1)
+        for num_slots in args.slots:
+            result = run(num_slots, iterative, args, content_path, style_path)
+            result['speedup'] = result['jobs_per_hour'] / results[0]['jobs_per_hour'] if results else 1.0
+            results.append(result)
+            print(f'slots {num_slots:2} threads/slot {result["threads_per_slot"]:2}  '
+                f'total {result["total_time"]:7.1f} s  {result["jobs_per_hour"]:8.1f} jobs/h  '
+                f'speedup {result["speedup"]:4.2f}  latency p50 {result["latency_p50"]:6.1f} s', file=sys.stderr)
+
+    if args.output:
+        report = {'meta': {'cpu_count': len(os.sched_getaffinity(0)), 'versions': versions, 'models': models,
+            'jobs': args.jobs, 'size': args.size, 'steps': args.steps}, 'results': results}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
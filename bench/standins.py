@@ -0,0 +1,32 @@
+import tensorflow as tf
+
+
+class HubModelStandIn(tf.Module):
+    # same interface and graph layout as the hub model (including a 100-d style bottleneck), with random weights
+    spec = tf.TensorSpec([None, None, None, 3], tf.float32)
+
+    def __init__(self, seed=0, channels=32, bottleneck=100):
+        super().__init__()
+        rng = tf.random.Generator.from_seed(seed)
+        weight = lambda *shape: tf.Variable(rng.normal(shape, stddev=0.1))
+        self.style_conv = weight(3, 3, 3, channels)
+        self.bottleneck_weight = weight(1, 1, channels, bottleneck)
+        self.bottleneck_bias = tf.Variable(tf.zeros([bottleneck]))
+        self.style_params = weight(1, 1, bottleneck, channels)
+        self.convs = [weight(9, 9, 3, channels), weight(3, 3, channels, channels), weight(3, 3, channels, channels),
+            weight(9, 9, channels, 3)]
+
+    @tf.function(input_signature=[spec, spec])
+    def __call__(self, content, style):
+        features = tf.nn.relu(tf.nn.conv2d(style, self.style_conv, 2, 'SAME'))
+        features = tf.reduce_mean(features, axis=[1, 2], keepdims=True)
+        with tf.name_scope('bottleneck'):
+            bottleneck = tf.nn.conv2d(features, self.bottleneck_weight, 1, 'SAME')
+            bottleneck = tf.nn.bias_add(bottleneck, self.bottleneck_bias, name='BiasAdd')
+        beta = tf.nn.conv2d(bottleneck, self.style_params, 1, 'SAME')
+        x = content
+        for i, conv in enumerate(self.convs):
+            x = tf.nn.conv2d(x, conv, 1, 'SAME')
+            if i < len(self.convs) - 1:
+                x = tf.nn.relu(x + beta)
+        return [tf.sigmoid(x)]
@@ -0,0 +1,31 @@
+import numpy as np
+from PIL import Image
+
+
+def get_rss(field='VmRSS'):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(f'{field}:'):
+                return int(line.split()[1]) / 1024
+
+
+def reset_peak_rss():
+    # ru_maxrss survives fork and exec, so use the resettable high water mark instead
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+
+
+def get_peak_rss():
+    return get_rss('VmHWM')
+
+
+def make_image(path, fmt, mp, seed=0):
+    width = round((mp * 1024 * 1024 * 4 / 3) ** 0.5)
+    height = round(width * 3 / 4)
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, np.newaxis]
+    array = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1)
+    array += rng.normal(0, 8, array.shape).astype(np.float32)
+    Image.fromarray(np.clip(array, 0, 255).astype(np.uint8)).save(path, format=fmt)
+    return width, height
@@ -1,8 +1,11 @@
 JOBS_DIR = 'jobs'
 DATABASE = 'db.sqlite3'
+CACHE_DIR = 'cache'
 
-DEFAULT_QUEUE = 'default'
+FAST_QUEUE = 'fast'
+ITERATIVE_QUEUE = 'iterative'
 SYSTEM_QUEUE = 'system'
+LEGACY_QUEUE = 'default'  # jobs enqueued before the queue split, remove in the next release
 
 HEALTH_CHECK_JOB_ID = 'health_check'
 IMAGE_CHECK_JOB_ID = 'image_check'
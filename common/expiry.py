@@ -0,0 +1,25 @@
+import time
+
+from . import NAME
+
+
+INDEX_KEY = f'{NAME}:expiry'
+
+
+def get_max_ttl(job_kwargs):
+    # upper bound on the lifetime of a job directory: waiting in the queue and running, once more for each retry,
+    # then keeping the result
+    retries = job_kwargs['retry'].max if job_kwargs.get('retry') else 0
+    return (job_kwargs['ttl'] + job_kwargs['job_timeout']) * (1 + retries) + job_kwargs['result_ttl']
+
+
+def schedule(redis, name, ttl):
+    redis.zadd(INDEX_KEY, {name: time.time() + ttl})
+
+
+def get_expired(redis):
+    return [name.decode() for name in redis.zrangebyscore(INDEX_KEY, '-inf', time.time())]
+
+
+def remove(redis, name):
+    redis.zrem(INDEX_KEY, name)
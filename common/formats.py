@@ -0,0 +1,33 @@
+# result formats by file extension: pillow format, mime type and encoder options
+FORMATS = {
+    'png': ('PNG', 'image/png', {'compress_level': 6}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 90, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', 'image/webp', {'quality': 90, 'method': 4}),
+    'avif': ('AVIF', 'image/avif', {'quality': 80}),  # requires pillow 11.2 or later
+}
+UNIVERSAL_FORMATS = ['jpg', 'png']  # safe to send without negotiation
+FALLBACK_FORMAT = 'jpg'  # for clients that don't accept the result format
+THUMBNAIL_SIZE = 480
+
+
+def save_image(image, path, ext=None):
+    format, _, options = FORMATS[ext or path.suffix[1:].lower()]
+    image.save(path, format=format, **options)
+
+
+def get_variant_path(path, ext, thumbnail=False):
+    return path.with_name(f'.thumbnail.{ext}' if thumbnail else f'.fallback.{ext}')
+
+
+def save_variants(image, path):
+    # the fallback format and the thumbnails are kept next to the result, for the web to pick
+    orig_ext = path.suffix[1:].lower()
+    exts = [orig_ext]
+    if orig_ext not in UNIVERSAL_FORMATS:
+        exts.append(FALLBACK_FORMAT)
+        save_image(image, get_variant_path(path, FALLBACK_FORMAT), FALLBACK_FORMAT)
+    if max(image.size) > THUMBNAIL_SIZE:
+        thumbnail = image.copy()
+        thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        for ext in exts:
+            save_image(thumbnail, get_variant_path(path, ext, thumbnail=True), ext)
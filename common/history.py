@@ -1,34 +1,160 @@
+import math
+from datetime import datetime
+
+
+PERIODS = ['hour', '_4_hours', 'day', 'week', 'month', '_3_months', 'year']
+MODIFIERS = ['-1 hour', '-4 hours', '-1 day', '-7 days', '-1 month', '-3 months', '-1 year']
+PHASES = ['queue', 'load', 'model', 'save', 'total']
+PERCENTILES = [50, 95, 99]
+HOUR_FORMAT = '%Y-%m-%d %H:00:00'
+STATUS_COLUMNS = {True: 'finished', False: 'failed', None: 'unfinished'}
+STATUS_COUNTS = ('COUNT(*) FILTER (WHERE succeeded IS 1), COUNT(*) FILTER (WHERE succeeded IS 0), '
+    'COUNT(*) FILTER (WHERE succeeded IS NULL)')
+TIMING_QUERY = ('SELECT strftime(?, h.started) AS hour, h.meta, t.queue_time AS queue, t.load_time AS load, '
+    't.model_time AS model, t.save_time AS save, (julianday(h.ended) - julianday(h.started)) * 86400 AS total '
+    'FROM job_timing t JOIN job_history h ON h.id = t.job_id')
+BUCKET_BASE = 1.05  # timing histogram resolution, the percentiles are within 2.5%
+MIN_TIME = 0.001
+
+
 def start_job(db, meta=None):
     with db:
         cur = db.execute('INSERT INTO job_history (meta) VALUES (?)', (meta,))
+        db.execute('INSERT INTO job_stats_hourly (hour, unfinished) SELECT strftime(?, started), 1 FROM job_history '
+            'WHERE id = ? ON CONFLICT (hour) DO UPDATE SET unfinished = unfinished + 1', (HOUR_FORMAT, cur.lastrowid))
         return cur.lastrowid
 
 
 def end_job(db, id, succeeded):
+    column = STATUS_COLUMNS[bool(succeeded)]
     with db:
+        db.execute(f'UPDATE job_stats_hourly SET unfinished = unfinished - 1, {column} = {column} + 1 '
+            'WHERE hour = (SELECT strftime(?, started) FROM job_history WHERE id = ? AND succeeded IS NULL)',
+            (HOUR_FORMAT, id))
         cur = db.execute('UPDATE job_history SET succeeded = ?, ended = CURRENT_TIMESTAMP WHERE id = ?',
             (succeeded, id))
         if not cur.rowcount:
             raise ValueError('Job history entry not found.')
+        add_timing_stats(db, db.execute(f'{TIMING_QUERY} WHERE h.id = ?', (HOUR_FORMAT, id)))
+
+
+def cancel_job(db, id):
+    with db:
+        db.execute('UPDATE job_stats_hourly SET unfinished = unfinished - 1 '
+            'WHERE hour = (SELECT strftime(?, started) FROM job_history WHERE id = ? AND succeeded IS NULL)',
+            (HOUR_FORMAT, id))
+        cur = db.execute('DELETE FROM job_history WHERE id = ?', (id,))
+        if not cur.rowcount:
+            raise ValueError('Job history entry not found.')
+
+
+def record_timing(db, id, queue_time, timings, input_size, output_size):
+    with db:
+        db.execute('INSERT INTO job_timing (job_id, queue_time, load_time, model_time, save_time, '
+            'input_width, input_height, output_width, output_height) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (id, queue_time, timings['load'], timings['model'], timings['save'], *input_size, *output_size))
+
+
+def get_run_times(db, modifier='-1 day'):
+    cur = db.execute('SELECT h.meta, t.load_time + t.model_time + t.save_time AS time, t.input_width, t.input_height '
+        "FROM job_timing t JOIN job_history h ON h.id = t.job_id WHERE h.started > datetime('now', ?)", (modifier,))
+    return cur.fetchall()
+
+
+def get_timing_bucket(value):
+    return math.floor(math.log(max(value, MIN_TIME), BUCKET_BASE))
+
+
+def get_timing_counts(rows):
+    counts = {}
+    for row in rows:
+        for phase in PHASES:
+            if row[phase] is not None:
+                key = row['hour'], row['meta'] or '', phase, get_timing_bucket(row[phase])
+                counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def add_timing_stats(db, rows):
+    counts = get_timing_counts(rows)
+    db.executemany('INSERT INTO job_timing_hourly (hour, meta, phase, bucket, count) VALUES (?, ?, ?, ?, ?) '
+        'ON CONFLICT (hour, meta, phase, bucket) DO UPDATE SET count = count + excluded.count',
+        [key + (count,) for key, count in counts.items()])
 
 
 def get_job_stats(db):
-    periods = ['hour', '_4_hours', 'day', 'week', 'month', '_3_months', 'year']
-    modifiers = ['-1 hour', '-4 hours', '-1 day', '-7 days', '-1 month', '-3 months', '-1 year']
-    rows = []
-    for succeeded in [True, False, None]:
-        cols = []
-        params = []
-        for period, modifier in zip(periods, modifiers):
-            cols.append(f"COUNT(*) FILTER (WHERE started > datetime('now', ?)) as {period}")
-            params.append(modifier)
-        cur = db.execute(f"SELECT {', '.join(cols)} FROM job_history WHERE succeeded IS ?", params + [succeeded])
-        row = cur.fetchone()
-        rows.append(row)
-    return {period.replace('_', ' ').strip(): [row[period] for row in rows] for period in periods}
+    # whole hours come from the rollup, the partial first hour and the current hour from the (indexed) raw table
+    cols = ["datetime('now', ?)"] * len(MODIFIERS)
+    cur = db.execute(f"SELECT strftime(?, 'now'), {', '.join(cols)}", [HOUR_FORMAT] + MODIFIERS)
+    current_hour, *cutoffs = cur.fetchone()
+    stats = {}
+    for period, cutoff in zip(PERIODS, cutoffs):
+        start_hour = datetime.fromisoformat(cutoff).strftime(HOUR_FORMAT)
+        cur = db.execute(f'SELECT {STATUS_COUNTS} FROM job_history '
+            "WHERE (started > ? AND started < datetime(?, '+1 hour')) OR started >= ?",
+            (cutoff, start_hour, current_hour))
+        counts = cur.fetchone()
+        cur = db.execute('SELECT TOTAL(finished), TOTAL(failed), TOTAL(unfinished) FROM job_stats_hourly '
+            'WHERE hour > ? AND hour < ?', (start_hour, current_hour))
+        stats[period.replace('_', ' ').strip()] = [a + int(b) for a, b in zip(counts, cur.fetchone())]
+    return stats
+
+
+def rebuild_job_stats(db):
+    with db:
+        db.execute('DELETE FROM job_stats_hourly')
+        db.execute(f'INSERT INTO job_stats_hourly (hour, finished, failed, unfinished) '
+            f'SELECT strftime(?, started) AS hour, {STATUS_COUNTS} FROM job_history GROUP BY hour', (HOUR_FORMAT,))
+        db.execute('DELETE FROM job_timing_hourly')
+        add_timing_stats(db, db.execute(f'{TIMING_QUERY} WHERE h.ended IS NOT NULL', (HOUR_FORMAT,)))
+
+
+def get_percentile(values, percentile):
+    # nearest rank, values must be sorted
+    return values[max(math.ceil(percentile / 100 * len(values)) - 1, 0)]
+
+
+def get_histogram_percentile(histogram, percentile):
+    # nearest rank, returns the middle of the bucket
+    rank = max(math.ceil(percentile / 100 * sum(histogram.values())), 1)
+    total = 0
+    for bucket in sorted(histogram):
+        total += histogram[bucket]
+        if total >= rank:
+            return BUCKET_BASE ** (bucket + 0.5)
+
+
+def get_timing_percentiles(db):
+    # like get_job_stats, with histograms from the rollup for whole hours, and from the raw tables for the rest
+    cols = ["datetime('now', ?)"] * len(MODIFIERS)
+    cur = db.execute(f"SELECT strftime(?, 'now'), {', '.join(cols)}", [HOUR_FORMAT] + MODIFIERS)
+    current_hour, *cutoffs = cur.fetchone()
+    stats = {}
+    for period, cutoff in zip(PERIODS, cutoffs):
+        start_hour = datetime.fromisoformat(cutoff).strftime(HOUR_FORMAT)
+        cur = db.execute(f'{TIMING_QUERY} WHERE h.ended IS NOT NULL AND '
+            "((h.started > ? AND h.started < datetime(?, '+1 hour')) OR h.started >= ?)",
+            (HOUR_FORMAT, cutoff, start_hour, current_hour))
+        counts = [(meta, phase, bucket, count) for (_, meta, phase, bucket), count in get_timing_counts(cur).items()]
+        cur = db.execute('SELECT meta, phase, bucket, SUM(count) FROM job_timing_hourly '
+            'WHERE hour > ? AND hour < ? GROUP BY meta, phase, bucket', (start_hour, current_hour))
+        histograms = {}
+        for meta, phase, bucket, count in counts + cur.fetchall():
+            histogram = histograms.setdefault(meta, {}).setdefault(phase, {})
+            histogram[bucket] = histogram.get(bucket, 0) + count
+        for model, phase_histograms in histograms.items():
+            phase_stats = {phase: [get_histogram_percentile(phase_histograms[phase], p) for p in PERCENTILES]
+                if phase in phase_histograms else None for phase in PHASES}
+            count = sum(phase_histograms.get('model', {}).values())
+            stats.setdefault(model, {})[period.replace('_', ' ').strip()] = count, phase_stats
+    return {model: stats[model] for model in sorted(stats)}
 
 
 def cleanup(db):
     with db:
+        db.execute("DELETE FROM job_timing WHERE job_id IN "
+            "(SELECT id FROM job_history WHERE started < datetime('now', '-1 year'))")
         cur = db.execute("DELETE FROM job_history WHERE started < datetime('now', '-1 year')")
+        db.execute("DELETE FROM job_stats_hourly WHERE hour <= strftime(?, 'now', '-1 year')", (HOUR_FORMAT,))
+        db.execute("DELETE FROM job_timing_hourly WHERE hour <= strftime(?, 'now', '-1 year')", (HOUR_FORMAT,))
         return cur.rowcount
@@ -0,0 +1,40 @@
+import hashlib
+
+from . import NAME
+
+
+INDEX_PREFIX = f'{NAME}:results:'
+STATS_KEY = f'{NAME}:result_stats'
+
+
+def get_key(files, *params):
+    digest = hashlib.sha256(repr(params).encode())
+    for f in files:
+        pos = f.tell()
+        f.seek(0)
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+        digest.update(b'\0')
+        f.seek(pos)
+    return digest.hexdigest()
+
+
+def lookup(redis, key):
+    path = redis.get(INDEX_PREFIX + key)
+    redis.hincrby(STATS_KEY, 'hits' if path is not None else 'misses')
+    return path.decode() if path is not None else None
+
+
+def register(redis, key, path, ttl):
+    redis.set(INDEX_PREFIX + key, path, ex=ttl)
+
+
+def unregister(redis, key):
+    redis.delete(INDEX_PREFIX + key)
+
+
+def get_stats(redis):
+    stats = redis.hgetall(STATS_KEY)
+    hits, misses = [int(stats.get(k, 0)) for k in [b'hits', b'misses']]
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else None}
@@ -0,0 +1,143 @@
+from rq import Queue as BaseQueue
+from rq.registry import StartedJobRegistry as BaseStartedJobRegistry
+
+from . import NAME
+
+
+KEY_PREFIX = f'{NAME}:scheduling:'
+MAX_SIZES = {'fast': 512, 'iterative': 400}  # see worker/models.py
+TIME_PER_MP = {'fast': 4.0, 'iterative': 9000.0}  # run time per work megapixel, until calibrated from the history
+TAG_TTL = 24 * 60 * 60  # longer than a job can wait and run, forgets jobs that never finished
+
+# Virtual clock fair queuing, with costs in milliseconds. A job's tag is its estimated finish time if its session got
+# a fair share of the workers: the later of now and the tag of the session's previous job, plus the job's cost.
+# The queue is kept sorted by tag, so cheap jobs go first, a session's backlog only delays its own jobs, and a job is
+# only passed by jobs that arrive before its tag, which ages it. Retried jobs keep their tags.
+REGISTER_SCRIPT = '''
+local tags, costs, sessions, finish, waiting = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5]
+local job_id, session, cost, tag_ttl = ARGV[1], ARGV[2], tonumber(ARGV[3]), tonumber(ARGV[4])
+local time = redis.call('TIME')
+local now = time[1] * 1000 + math.floor(time[2] / 1000)
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', tags, '-inf', now - tag_ttl)) do
+    redis.call('HDEL', costs, id)
+    redis.call('HDEL', sessions, id)
+end
+redis.call('ZREMRANGEBYSCORE', tags, '-inf', now - tag_ttl)
+redis.call('ZREMRANGEBYSCORE', waiting, '-inf', now - tag_ttl)
+redis.call('ZREMRANGEBYSCORE', finish, '-inf', now)
+local tag = math.max(now, tonumber(redis.call('ZSCORE', finish, session) or 0)) + cost
+redis.call('ZADD', finish, tag, session)
+redis.call('ZADD', tags, tag, job_id)
+redis.call('HSET', costs, job_id, cost)
+redis.call('HSET', sessions, job_id, session)
+'''
+
+# waiting holds the tags of the queued jobs, the next later one is where the job goes; the entries of jobs that left
+# the queue without dequeue_any, e.g. expired ones, are dropped when found
+PUSH_SCRIPT = '''
+local queue, tags, waiting = KEYS[1], KEYS[2], KEYS[3]
+local job_id = ARGV[1]
+local tag = redis.call('ZSCORE', tags, job_id)
+if not tag then
+    return redis.call('RPUSH', queue, job_id)
+end
+redis.call('ZADD', waiting, tag, job_id)
+while true do
+    local next_id = redis.call('ZRANGEBYSCORE', waiting, '(' .. tag, '+inf', 'LIMIT', 0, 1)[1]
+    if not next_id then
+        return redis.call('RPUSH', queue, job_id)
+    end
+    local length = redis.call('LINSERT', queue, 'BEFORE', next_id, job_id)
+    if length > 0 then
+        return length
+    end
+    redis.call('ZREM', waiting, next_id)
+end
+'''
+
+# a canceled job that was its session's last one gives the session its share back
+REMOVE_SCRIPT = '''
+local tags, costs, sessions, finish, waiting = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5]
+local job_id, refund = ARGV[1], ARGV[2] == '1'
+local tag = redis.call('ZSCORE', tags, job_id)
+local session = redis.call('HGET', sessions, job_id)
+if refund and tag and session and redis.call('ZSCORE', finish, session) == tag then
+    redis.call('ZADD', finish, tonumber(tag) - tonumber(redis.call('HGET', costs, job_id)), session)
+end
+redis.call('ZREM', tags, job_id)
+redis.call('ZREM', waiting, job_id)
+redis.call('HDEL', costs, job_id)
+redis.call('HDEL', sessions, job_id)
+'''
+
+
+def get_work_megapixels(model, width, height):
+    scale = min(MAX_SIZES[model] / max(width, height), 1)
+    return width * height * scale * scale / 1e6
+
+
+def get_cost(model, width, height, time_per_mp=None):
+    time_per_mp = (time_per_mp or TIME_PER_MP)[model]
+    return time_per_mp * get_work_megapixels(model, width, height)
+
+
+class Queue(BaseQueue):
+    # jobs registered with a session and a cost are pushed in fair share order, others go to the back as usual
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        prefix = f'{KEY_PREFIX}{self.name}:'
+        self.scheduling_keys = [prefix + k for k in ['tags', 'costs', 'sessions', 'finish', 'waiting']]
+        self.register_script = self.connection.register_script(REGISTER_SCRIPT)
+        self.push_script = self.connection.register_script(PUSH_SCRIPT)
+        self.remove_script = self.connection.register_script(REMOVE_SCRIPT)
+
+    @classmethod
+    def dequeue_any(cls, *args, **kwargs):
+        result = super().dequeue_any(*args, **kwargs)
+        if result is not None:
+            job, queue = result
+            queue.connection.zrem(queue.scheduling_keys[4], job.id)
+        return result
+
+    def register_job(self, job_id, session_id, cost):
+        # before enqueueing
+        self.register_script(keys=self.scheduling_keys,
+            args=[job_id, session_id, max(round(cost * 1000), 1), TAG_TTL * 1000])
+
+    def unregister_job(self, job_id, refund=False):
+        self.remove_script(keys=self.scheduling_keys, args=[job_id, int(refund)])
+
+    def push_job_id(self, job_id, pipeline=None, at_front=False):
+        if at_front:
+            return super().push_job_id(job_id, pipeline=pipeline, at_front=at_front)
+        tags, costs, sessions, finish, waiting = self.scheduling_keys
+        self.push_script(keys=[self.key, tags, waiting], args=[job_id],
+            client=pipeline if pipeline is not None else self.connection)
+
+    def get_estimates(self, workers):
+        # position and estimated seconds until finished, for each queued job, given the workers that serve the queue;
+        # their running jobs, from any of their queues, are assumed half done
+        tags, costs, sessions, finish, waiting = self.scheduling_keys
+        running = [(job_id, name) for worker in workers if (job_id := worker.get_current_job_id())
+            for name in worker.queue_names()]
+        with self.connection.pipeline() as pipeline:
+            pipeline.lrange(self.key, 0, -1)
+            pipeline.hgetall(costs)
+            for job_id, name in running:
+                pipeline.hget(f'{KEY_PREFIX}{name}:costs', job_id)
+            job_ids, costs, *running_costs = pipeline.execute()
+        costs = {job_id: int(cost) / 1000 for job_id, cost in costs.items()}
+        backlog = sum(int(cost) / 1000 for cost in running_costs if cost is not None) / 2
+        num_workers = max(len(workers), 1)
+        estimates = {}
+        for position, job_id in enumerate(job_ids):
+            cost = costs.get(job_id, 0)  # unregistered jobs, e.g. the image check, are short
+            estimates[job_id.decode()] = position, backlog / num_workers + cost
+            backlog += cost
+        return estimates
+
+
+class StartedJobRegistry(BaseStartedJobRegistry):
+    # abandoned jobs with retries left go back to their place in the schedule
+    def get_queue(self):
+        return Queue(self.name, connection=self.connection, serializer=self.serializer)
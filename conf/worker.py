@@ -1,16 +1,42 @@
 import os
 import sys
+import gc
+import time
 import functools
+import multiprocessing
 
 from rq import SimpleWorker
+from rq.utils import current_timestamp
+from rq.worker_pool import WorkerPool as BaseWorkerPool
 import sentry_sdk
 
-from common import VERSION, config
+from common import VERSION, config, scheduling
 
 
 REDIS_URL = f'redis://{os.environ["REDIS_HOST"]}?socket_connect_timeout=15'  # socket_timeout is handled by rq
-QUEUES = [config.SYSTEM_QUEUE, config.DEFAULT_QUEUE]
+QUEUES = [config.SYSTEM_QUEUE, *os.getenv('WORKER_QUEUES', f'{config.FAST_QUEUE},{config.ITERATIVE_QUEUE}').split(','),
+    config.LEGACY_QUEUE]
 SENTRY_DSN = os.environ['SENTRY_DSN']
+FAST_BATCH_SIZE = int(os.getenv('FAST_BATCH_SIZE', '1'))  # 1 to disable batching
+FAST_BATCH_LINGER = float(os.getenv('FAST_BATCH_LINGER', '0.05'))
+FAST_BATCH_FUNC = 'worker.tasks.fast_style_transfer'
+WORKER_SLOTS = int(os.getenv('WORKER_SLOTS', '1'))  # concurrent jobs per container, see conf/worker_pool.py
+# take the batched jobs off the queue and mark them started, so that they are not run twice, and a crash fails them
+CLAIM_SCRIPT = '''
+local queue, started, waiting = KEYS[1], KEYS[2], KEYS[3]
+local score, job_prefix = ARGV[1], ARGV[2]
+local claimed = {}
+for i = 3, #ARGV do
+    local job_id = ARGV[i]
+    if redis.call('LREM', queue, 1, job_id) > 0 then
+        redis.call('ZREM', waiting, job_id)
+        redis.call('ZADD', started, score, job_id)
+        redis.call('HSET', job_prefix .. job_id, 'status', 'started')
+        table.insert(claimed, job_id)
+    end
+end
+return claimed
+'''
 DICT_CONFIG = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -38,13 +64,134 @@ DICT_CONFIG = {
 
 
 class Worker(SimpleWorker):
+    queue_class = scheduling.Queue  # retried jobs go back to their place in the schedule
+
     def __init__(self, *args, **kwargs):
-        # preload libraries
+        super().__init__(*args, **kwargs)
+        self.log_result_lifespan = False
+        self.claim_script = self.connection.register_script(CLAIM_SCRIPT)
+        self.batch_queue = None
+        self.batch = []
+        if not issubclass(self.queue_class, scheduling.Queue):
+            # the rq cli overrides the class attribute, pass --queue-class common.scheduling.Queue
+            raise TypeError(f'{self.queue_class} is not a subclass of {scheduling.Queue}.')
+
+        # preload only the libraries and models of the served queues
+        import worker.tasks
+        if config.FAST_QUEUE in self.queue_names():
+            import worker.fast
+        if config.ITERATIVE_QUEUE in self.queue_names():
+            import worker.iterative
+
+    def clean_registries(self):
+        # requeue abandoned jobs with retries left, i.e. iterative jobs after a crash, before rq's cleanup would push
+        # them to the back of the queue
+        for queue in self.queues:
+            if queue.acquire_maintenance_lock():
+                scheduling.StartedJobRegistry(queue=queue).cleanup()
+                queue.release_maintenance_lock()
+        super().clean_registries()
+
+    def handle_warm_shutdown_request(self):
+        super().handle_warm_shutdown_request()
+        # drain: a running iterative job saves a checkpoint and gets requeued instead of running to the end
+        from worker import checkpoints
+        checkpoints.drain.set()
+
+    def claim_batch(self, queue, job, n):
+        # the following jobs at the head of the queue, up to the first one that is not batched
+        jobs = {}
+        claimed = []
+        end_time = time.time() + FAST_BATCH_LINGER
+        while True:
+            job_ids = []
+            for job_id in queue.get_job_ids(0, n - len(claimed) - 2):
+                if job_id not in jobs:
+                    jobs[job_id] = queue.fetch_job(job_id)
+                if jobs[job_id] is None:
+                    continue
+                if jobs[job_id].func_name != FAST_BATCH_FUNC:
+                    break
+                job_ids.append(job_id)
+            if job_ids:
+                ttl = sum(self.get_heartbeat_ttl(j) for j in [job] + claimed + [jobs[job_id] for job_id in job_ids])
+                job_ids = self.claim_script(keys=[queue.key, queue.started_job_registry.key, queue.scheduling_keys[4]],
+                    args=[current_timestamp() + ttl, job.redis_job_namespace_prefix] + job_ids)
+                claimed += [jobs[job_id.decode()] for job_id in job_ids]
+            if len(claimed) >= n - 1 or time.time() >= end_time:
+                return [job] + claimed
+            time.sleep(0.01)
+
+    def prepare_job_execution(self, job, remove_from_intermediate_queue=False):
+        super().prepare_job_execution(job, remove_from_intermediate_queue)
+        if self.batch_queue is not None:
+            # the head of the batch, it runs the batch within its own timeout
+            queue, self.batch_queue = self.batch_queue, None
+            jobs = self.claim_batch(queue, job, FAST_BATCH_SIZE)
+            self.batch = jobs[1:]
+            if self.batch:
+                import worker.tasks
+                worker.tasks.pending_batch[:] = [j.args for j in jobs]
+
+    def execute_job(self, job, queue):
+        if FAST_BATCH_SIZE < 2 or job.func_name != FAST_BATCH_FUNC:
+            return super().execute_job(job, queue)
+
         import worker.tasks
-        import worker.models
 
+        self.batch_queue = queue
+        self.batch = []
+        try:
+            super().execute_job(job, queue)
+            # each claimed job runs as usual, from its prefetched output
+            for batch_job in self.batch:
+                super().execute_job(batch_job, queue)
+        finally:
+            self.batch_queue = None
+            worker.tasks.pending_batch.clear()
+            worker.tasks.clear_prefetched()
+
+
+def run_slot_worker(slot, num_slots, name, queue_names, connection_class, pool_class, pool_kwargs, worker_class,
+        burst=True, logging_level='INFO', _sleep=0, **kwargs):
+    # rq.worker_pool.run_worker, with scheduling queues
+    from redis import ConnectionPool
+    from worker import slots
+    slots.pin(slots.get_slot_cpus(slot, num_slots))
+    connection = connection_class(connection_pool=ConnectionPool(connection_class=pool_class, **pool_kwargs))
+    queues = [scheduling.Queue(queue_name, connection=connection) for queue_name in queue_names]
+    worker = worker_class(queues, name=name, connection=connection, queue_class=scheduling.Queue, **kwargs)
+    worker.log.info('Starting worker with PID %s', os.getpid())
+    time.sleep(_sleep)
+    worker.work(burst=burst, with_scheduler=True, logging_level=logging_level)
+
+
+class WorkerPool(BaseWorkerPool):
+    # one worker process per slot, each pinned to its share of the cores
+    def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.log_result_lifespan = False
+
+        from worker import slots
+        if config.ITERATIVE_QUEUE in self._queue_names:
+            slots.preload()
+        gc.freeze()  # keep the garbage collector from touching (and copying) the shared objects
+        self.slots = {}
+
+    def get_worker_process(self, name, burst, _sleep=0, logging_level='INFO'):
+        slot = min(set(range(self.num_workers)) - set(self.slots.values()))
+        self.slots[name] = slot
+        return multiprocessing.get_context('fork').Process(
+            target=run_slot_worker,
+            args=(slot, self.num_workers, name, self._queue_names, self._connection_class, self._pool_class,
+                self._pool_kwargs, self.worker_class),
+            kwargs={'_sleep': _sleep, 'burst': burst, 'logging_level': logging_level, 'job_class': self.job_class,
+                'serializer': self.serializer},
+            name=f'Worker {name} (WorkerPool {self.name}, slot {slot})'
+        )
+
+    def handle_dead_worker(self, worker_data):
+        self.slots.pop(worker_data.name, None)
+        super().handle_dead_worker(worker_data)
 
 
 fqn = f'{Worker.__module__}.{Worker.__qualname__}'
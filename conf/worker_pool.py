@@ -0,0 +1,23 @@
+# runs WORKER_SLOTS workers in one container: python -m conf.worker_pool
+import os
+import logging.config
+
+os.environ.setdefault('RQ_WORKER_CLASS', 'conf.worker.Worker')
+
+from redis import Redis
+from rq.contrib.sentry import register_sentry
+
+from conf import worker
+
+
+def main():
+    logging.config.dictConfig(worker.DICT_CONFIG)
+    if worker.SENTRY_DSN:
+        register_sentry(worker.SENTRY_DSN)
+    pool = worker.WorkerPool(worker.QUEUES, connection=Redis.from_url(worker.REDIS_URL),
+        num_workers=worker.WORKER_SLOTS, worker_class=worker.Worker)
+    pool.start()
+
+
+if __name__ == '__main__':
+    main()
@@ -7,5 +7,37 @@ CREATE TABLE IF NOT EXISTS job_history
     succeeded BOOLEAN
 );
 
--- not needed for now
--- CREATE INDEX IF NOT EXISTS job_history_started_idx ON job_history(started);
+CREATE TABLE IF NOT EXISTS job_timing
+(
+    job_id INTEGER PRIMARY KEY REFERENCES job_history (id),
+    queue_time REAL,
+    load_time REAL,
+    model_time REAL,
+    save_time REAL,
+    input_width INTEGER,
+    input_height INTEGER,
+    output_width INTEGER,
+    output_height INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS job_history_started_idx ON job_history(started);
+
+-- job counts by start hour, kept up to date by history.start_job and history.end_job
+CREATE TABLE IF NOT EXISTS job_stats_hourly
+(
+    hour TEXT PRIMARY KEY,
+    finished INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    unfinished INTEGER NOT NULL DEFAULT 0
+);
+
+-- job timing histograms by start hour, kept up to date by history.end_job
+CREATE TABLE IF NOT EXISTS job_timing_hourly
+(
+    hour TEXT NOT NULL,
+    meta TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, meta, phase, bucket)
+);
@@ -38,11 +38,26 @@
     let listenTimeout = null;
 
     if (stateData) {
-        setState(stateData.initialStatus, stateData.initialQueuePosition);
+        setState(stateData.initialStatus, stateData.initialQueuePosition, stateData.initialProgress,
+            stateData.initialEta);
     }
 
 
-    function setState(status, position) {
+    function formatEta(eta) {
+        const minutes = Math.ceil(eta / 60);
+        return (minutes > 1 ? 'about ' + minutes + ' minutes' : 'less than a minute') + ' left';
+    }
+
+    function formatPosition(position, eta) {
+        const text = 'Position in the queue: ' + (position + 1);
+        return eta != null ? text + ', ' + formatEta(eta) : text;
+    }
+
+    function formatProgress(progress) {
+        return 'Step ' + progress.step + ' of ' + progress.total_steps + ', ' + formatEta(progress.eta);
+    }
+
+    function setState(status, position, progress, eta) {
         if (status === 'finished') {
             processingElement.hidden = true;
             document.getElementById('result').hidden = false;
@@ -60,7 +75,10 @@
             processingElement.hidden = false;
             if (position != null) {
                 processingStatusElement.classList.remove('invisible');
-                processingStatusElement.innerHTML = 'Position in the queue: ' + (position + 1);
+                processingStatusElement.innerHTML = formatPosition(position, eta);
+            } else if (progress != null) {
+                processingStatusElement.classList.remove('invisible');
+                processingStatusElement.innerHTML = formatProgress(progress);
             } else {
                 processingStatusElement.classList.add('invisible');
                 processingStatusElement.innerHTML = '&nbsp;';
@@ -94,7 +112,7 @@
         listenSocket.onmessage = evt => {
             clearTimeout(listenTimeout);
             const data = JSON.parse(evt.data);
-            setState(data.status, data.position);
+            setState(data.status, data.position, data.progress, data.eta);
             if (terminalStatus) {
                 listenSocket.close();
             } else {
@@ -113,7 +131,7 @@
     function pollState() {
         axios.get(stateData.pollUrl, {timeout: requestTimeout})
             .then(response => {
-                setState(response.data.status, response.data.position);
+                setState(response.data.status, response.data.position, response.data.progress, response.data.eta);
             })
             .catch(error => {
                 const status = error.response?.status;
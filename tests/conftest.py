@@ -0,0 +1,44 @@
+import os
+import uuid
+from pathlib import Path
+
+import pytest
+import redis
+
+
+ROOT = Path(__file__).parent.parent
+REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
+ENV = {
+    'APP_ENV': 'development',
+    'SENTRY_DSN': '',
+    'SERVICE_NAME': 'worker',
+    'REDIS_HOST': REDIS_HOST,
+    'RQ_WORKER_CLASS': 'conf.worker.Worker',
+}
+
+os.environ.update({k: os.environ.get(k, v) for k, v in ENV.items()})  # for conf.worker and worker.tasks
+
+
+@pytest.fixture
+def redis_client():
+    client = redis.Redis(REDIS_HOST)
+    try:
+        client.ping()
+    except redis.ConnectionError:
+        pytest.skip(f'Redis is not available at {REDIS_HOST}.')
+    return client
+
+
+@pytest.fixture
+def queue_name(redis_client):
+    # a fresh queue, so that the tests can share a redis server with other data
+    name = f'test-{uuid.uuid4().hex}'
+    yield name
+    keys = redis_client.keys(f'*{name}*')
+    if keys:
+        redis_client.delete(*keys)
+
+
+@pytest.fixture
+def worker_env(queue_name):
+    return {**os.environ, 'PYTHONPATH': str(ROOT), 'WORKER_QUEUES': queue_name, 'WORKER_SLOTS': '1'}
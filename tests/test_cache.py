@@ -0,0 +1,29 @@
+from worker import cache
+
+
+def test_stats(redis_client, queue_name, monkeypatch):
+    monkeypatch.setattr(cache, 'STATS_KEY', f'{queue_name}:cache_stats')
+    monkeypatch.setattr(cache, 'caches', {})
+    features = cache.FeatureCache('features', 10, getsizeof=lambda value: 1)
+    features.put('a', 1)
+    features.get('a')
+    features.get('b')
+    cache.publish_stats(redis_client)
+    features.get('a')
+    cache.publish_stats(redis_client)
+    assert features.hits == features.misses == 0
+    assert cache.get_stats(redis_client) == {'features': {'hits': 2, 'misses': 1, 'entries': 1, 'workers': 1}}
+    assert cache.get_stats(redis_client) == {}
+
+
+def test_disk_put_error(tmp_path, monkeypatch):
+    def dump(value, f):
+        f.write(b'partial')
+        raise TypeError('not serializable')
+
+    monkeypatch.setattr(cache, 'CACHE_DIR', tmp_path)
+    monkeypatch.setattr(cache, 'caches', {})
+    features = cache.FeatureCache('features', 10, getsizeof=lambda value: 1, disk_max_size=1000, dump=dump)
+    features.put('a', object())
+    assert features.get('a') is not None
+    assert list((tmp_path / 'features').iterdir()) == []
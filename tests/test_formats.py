@@ -0,0 +1,16 @@
+from PIL import Image
+
+from common import formats
+
+
+def test_save_variants(tmp_path):
+    path = tmp_path / 'result.webp'
+    formats.save_variants(Image.new('RGB', (960, 640)), path)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['.fallback.jpg', '.thumbnail.jpg', '.thumbnail.webp']
+    with Image.open(formats.get_variant_path(path, 'webp', thumbnail=True)) as image:
+        assert image.size == (480, 320)
+
+
+def test_save_variants_small(tmp_path):
+    formats.save_variants(Image.new('RGB', (320, 240)), tmp_path / 'result.png')
+    assert list(tmp_path.iterdir()) == []
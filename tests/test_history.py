@@ -0,0 +1,43 @@
+import sqlite3
+
+import pytest
+
+from common import history
+from .conftest import ROOT
+
+
+@pytest.fixture
+def db():
+    db = sqlite3.connect(':memory:')
+    db.row_factory = sqlite3.Row
+    db.executescript((ROOT / 'schema.sql').read_text())
+    yield db
+    db.close()
+
+
+def add_job(db, model, model_time, started="datetime('now')"):
+    id = history.start_job(db, model)
+    db.execute(f'UPDATE job_history SET started = {started} WHERE id = ?', (id,))
+    history.record_timing(db, id, 1.0, {'load': 0.5, 'model': model_time, 'save': 0.2}, (100, 100), (100, 100))
+    history.end_job(db, id, True)
+
+
+def test_timing_percentiles(db):
+    for i in range(1, 101):
+        add_job(db, 'fast', i / 10, "datetime('now', '-3 hours')")
+    add_job(db, 'fast', 100.0)
+    add_job(db, 'iterative', 50.0, "datetime('now', '-2 days')")
+    history.start_job(db, 'fast')
+    stats = history.get_timing_percentiles(db)
+    assert list(stats) == ['fast', 'iterative']
+    assert list(stats['iterative']) == ['week', 'month', '3 months', 'year']
+    count, phases = stats['fast']['hour']
+    assert count == 1 and phases['model'][0] == pytest.approx(100, rel=0.05)
+    count, phases = stats['fast']['day']
+    assert count == 101
+    for value, expected in zip(phases['model'], [5.0, 9.5, 9.9]):
+        assert value == pytest.approx(expected, rel=0.05)
+    assert phases['load'][0] == pytest.approx(0.5, rel=0.05)
+    before = history.get_timing_percentiles(db)
+    history.rebuild_job_stats(db)
+    assert history.get_timing_percentiles(db) == before
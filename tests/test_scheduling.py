@@ -0,0 +1,76 @@
+import pytest
+from rq import Worker
+
+from common import scheduling
+
+
+@pytest.fixture
+def queue(redis_client, queue_name):
+    return scheduling.Queue(queue_name, connection=redis_client)
+
+
+def enqueue(queue, job_id, session_id, cost):
+    queue.register_job(job_id, session_id, cost)
+    return queue.enqueue('os.getpid', job_id=job_id)
+
+
+def test_fair_share(queue):
+    for i in range(3):
+        enqueue(queue, f'a{i}', 'a', 100)
+    enqueue(queue, 'b0', 'b', 100)
+    enqueue(queue, 'c0', 'c', 10)
+    assert queue.get_job_ids() == ['c0', 'a0', 'b0', 'a1', 'a2']
+
+
+def test_unregistered_jobs(queue):
+    enqueue(queue, 'a0', 'a', 100)
+    queue.enqueue('os.getpid', job_id='x')
+    enqueue(queue, 'b0', 'b', 10)
+    queue.enqueue('os.getpid', job_id='y', at_front=True)
+    assert queue.get_job_ids() == ['y', 'b0', 'a0', 'x']
+
+
+def test_retry_keeps_tag(queue):
+    enqueue(queue, 'a0', 'a', 10)
+    enqueue(queue, 'b0', 'b', 20)
+    job, _ = scheduling.Queue.dequeue_any([queue], None, connection=queue.connection)
+    assert job.id == 'a0'
+    enqueue(queue, 'c0', 'c', 30)
+    queue.enqueue_job(job)
+    assert queue.get_job_ids() == ['a0', 'b0', 'c0']
+
+
+def test_stale_entries(queue):
+    enqueue(queue, 'a0', 'a', 10)
+    enqueue(queue, 'b0', 'b', 20)
+    queue.remove('b0')  # e.g. canceled, without unregistering
+    enqueue(queue, 'c0', 'c', 15)
+    assert queue.get_job_ids() == ['a0', 'c0']
+    assert queue.connection.zrange(queue.scheduling_keys[4], 0, -1) == [b'a0', b'c0']
+
+
+def test_cancel_refund(queue):
+    enqueue(queue, 'a0', 'a', 100)
+    enqueue(queue, 'a1', 'a', 100)
+    queue.remove('a1')
+    queue.unregister_job('a1', refund=True)
+    enqueue(queue, 'b0', 'b', 250)
+    enqueue(queue, 'a2', 'a', 100)
+    assert queue.get_job_ids() == ['a0', 'a2', 'b0']
+
+
+def test_estimates(queue):
+    enqueue(queue, 'a0', 'a', 10)
+    enqueue(queue, 'b0', 'b', 20)
+    enqueue(queue, 'c0', 'c', 30)
+    assert queue.get_estimates([]) == {'a0': (0, 10), 'b0': (1, 30), 'c0': (2, 60)}
+
+
+def test_estimates_shared_workers(queue, queue_name, redis_client):
+    # the workers also serve another queue, whose running jobs delay this one's
+    other = scheduling.Queue(f'{queue_name}-other', connection=redis_client)
+    enqueue(other, 'x0', 'x', 40)
+    enqueue(queue, 'a0', 'a', 10)
+    workers = [Worker([queue, other], name=f'{queue_name}-{i}', connection=redis_client) for i in range(2)]
+    workers[0].set_current_job_id('x0')
+    assert queue.get_estimates(workers) == {'a0': (0, 20)}
@@ -0,0 +1,115 @@
+import re
+import sys
+import json
+import time
+import signal
+import subprocess
+
+from rq import Retry
+from rq.job import JobStatus
+
+from common import scheduling, expiry
+from worker import checkpoints
+from .conftest import ROOT
+
+
+def get_worker_command():
+    dockerfile = (ROOT / 'docker' / 'app' / 'Dockerfile').read_text()
+    stage = dockerfile[dockerfile.index('AS worker'):]
+    return json.loads(re.search(r'^CMD (\[.*\])$', stage, re.MULTILINE).group(1))
+
+
+def drained(*args, **kwargs):
+    # what an iterative job does when the worker drains
+    raise checkpoints.Interrupted('Drained.')
+
+
+def enqueue(queue, job_id, session_id, cost, func='os.getpid', args=None, **kwargs):
+    queue.register_job(job_id, session_id, cost)
+    return queue.enqueue(func, args=args, job_id=job_id, **kwargs)
+
+
+def wait_for_status(job, status, timeout):
+    end_time = time.time() + timeout
+    while job.get_status() != status and time.time() < end_time:
+        time.sleep(0.1)
+    return job.get_status()
+
+
+def test_rq_worker(redis_client, queue_name, worker_env):
+    queue = scheduling.Queue(queue_name, connection=redis_client)
+    job = queue.enqueue('os.getpid')
+    subprocess.run(get_worker_command() + ['--burst'], cwd=ROOT, env=worker_env, check=True, timeout=120)
+    assert job.get_status() == JobStatus.FINISHED
+
+
+def test_worker_pool(redis_client, queue_name, worker_env):
+    queue = scheduling.Queue(queue_name, connection=redis_client)
+    job = queue.enqueue('os.getpid')
+    process = subprocess.Popen([sys.executable, '-m', 'conf.worker_pool'], cwd=ROOT, env=worker_env)
+    try:
+        assert wait_for_status(job, JobStatus.FINISHED, 120) == JobStatus.FINISHED
+        assert process.poll() is None
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait(timeout=60)
+
+
+def test_drain_requeue(redis_client, queue_name):
+    from conf.worker import Worker
+    queue = scheduling.Queue(queue_name, connection=redis_client)
+    args = drained, queue_name, 'content.jpg', 'style.jpg', 100, 'result.png'
+    job = enqueue(queue, 'a0', 'a', 10, 'worker.tasks.style_transfer', args, kwargs={'with_history': False},
+        retry=Retry(max=1))
+    enqueue(queue, 'b0', 'b', 20)
+    try:
+        Worker([queue], connection=redis_client).work(burst=True, max_jobs=1)
+        enqueue(queue, 'c0', 'c', 30)
+        assert job.get_status() == JobStatus.QUEUED
+        assert queue.get_job_ids() == ['a0', 'b0', 'c0']
+        job.refresh()
+        assert job.retries_left == 1  # still requeued after a crash
+    finally:
+        expiry.remove(redis_client, queue_name)
+
+
+def test_crash_requeue(redis_client, queue_name):
+    from conf.worker import Worker
+    queue = scheduling.Queue(queue_name, connection=redis_client)
+    job = enqueue(queue, 'a0', 'a', 10, retry=Retry(max=1))
+    enqueue(queue, 'b0', 'b', 20)
+    job, _ = scheduling.Queue.dequeue_any([queue], None, connection=redis_client)
+    job.set_status(JobStatus.STARTED)
+    queue.started_job_registry.add(job, 0)  # abandoned by a crashed worker, expires now
+    enqueue(queue, 'c0', 'c', 30)
+    Worker([queue], connection=redis_client).clean_registries()
+    assert job.get_status() == JobStatus.QUEUED
+    assert queue.get_job_ids() == ['a0', 'b0', 'c0']
+
+
+def test_claim_batch(redis_client, queue_name):
+    from conf.worker import Worker, FAST_BATCH_FUNC
+    queue = scheduling.Queue(queue_name, connection=redis_client)
+    for job_id in ['f0', 'f1', 'f2']:
+        queue.enqueue(FAST_BATCH_FUNC, job_id=job_id)
+    queue.enqueue('os.getpid', job_id='x')
+    queue.enqueue(FAST_BATCH_FUNC, job_id='f3')
+    job, _ = scheduling.Queue.dequeue_any([queue], None, connection=redis_client)
+    batch = Worker([queue], connection=redis_client).claim_batch(queue, job, 4)
+    assert [j.id for j in batch] == ['f0', 'f1', 'f2']
+    assert queue.get_job_ids() == ['x', 'f3']
+    assert set(queue.started_job_registry.get_job_ids()) == {'f1', 'f2'}
+    assert batch[1].get_status() == JobStatus.STARTED
+
+
+def test_batch(redis_client, queue_name, monkeypatch):
+    import conf.worker
+    monkeypatch.setattr(conf.worker, 'FAST_BATCH_SIZE', 4)
+    monkeypatch.setattr(conf.worker, 'FAST_BATCH_FUNC', 'os.getpid')
+    queue = scheduling.Queue(queue_name, connection=redis_client)
+    jobs = [queue.enqueue('os.getpid', job_id=job_id) for job_id in ['g0', 'g1', 'g2']]
+    queue.enqueue('time.time', job_id='x')
+    conf.worker.Worker([queue], connection=redis_client).work(burst=True, max_jobs=1)
+    assert [job.get_status() for job in jobs] == [JobStatus.FINISHED] * 3
+    assert queue.get_job_ids() == ['x']
+    assert queue.started_job_registry.get_job_ids() == []
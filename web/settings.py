@@ -12,13 +12,13 @@ from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 import click
 import redis
-from rq import Queue, Worker
+from rq import Queue, Worker, Retry
 from rq_scheduler import Scheduler
 import rq_dashboard.cli
 from cachetools import cached, TTLCache
 import sentry_sdk
 
-from common import VERSION, config, database
+from common import VERSION, config, database, history, scheduling
 from web import wsapi
 from web import utils
 
@@ -28,12 +28,16 @@ RATE_LIMITS = {
     'iterative': '5/hour;20/day'
 }
 MAX_QUEUE_SIZE_PER_WORKER = 100
+MIN_CALIBRATION_JOBS = 10  # recent jobs needed to replace the default run time estimates
+MODEL_QUEUES = {'fast': config.FAST_QUEUE, 'iterative': config.ITERATIVE_QUEUE}
 MAX_UPLOAD_SIZE_MB = 10
 MAX_RESOLUTION_MP = 25
 ALLOWED_FORMATS = ['JPEG', 'PNG']
 ALLOWED_EXTENSIONS = ['jpg', 'jpeg', 'png']
 DEFAULT_STRENGTH = 75
-RESULT_FORMAT = ('png', 'image/png')
+RESULT_FORMAT = 'webp'  # see common.formats for the encoder settings
+IMAGE_CACHE_CONTROL = 'private, no-cache'  # revalidate to recheck the session, unchanged images get a 304
+X_ACCEL_LOCATION = '/internal/jobs/'  # see conf/nginx.conf
 RESULT_TTL_HOURS = 8
 QUEUE_TTL_HOURS = 2
 JOB_KWARGS_BASE = {
@@ -42,7 +46,11 @@ JOB_KWARGS_BASE = {
     'ttl': QUEUE_TTL_HOURS * 60 * 60,
     'failure_ttl': 2 * 60 * 60
 }
-JOB_KWARGS = {'fast': JOB_KWARGS_BASE, 'iterative': {**JOB_KWARGS_BASE, 'job_timeout': 60 * 60}}
+# iterative jobs are requeued once after a worker crash, and resume from their checkpoint
+JOB_KWARGS = {
+    'fast': JOB_KWARGS_BASE,
+    'iterative': {**JOB_KWARGS_BASE, 'job_timeout': 60 * 60, 'retry': Retry(max=1)}
+}
 USE_WEBSOCKET = True
 WEBSOCKET_PING_INTERVAL = 25
 STATUS_UPDATE_INTERVAL = 2
@@ -69,9 +77,42 @@ def get_jobs_dir(app):
     return get_data_dir(app) / config.JOBS_DIR
 
 
-@cached(cache=TTLCache(maxsize=1, ttl=60))
+@cached(cache=TTLCache(maxsize=len(MODEL_QUEUES), ttl=60))
+def get_worker_count(queue):
+    return max(Worker.count(queue=queue), 1)
+
+
 def get_max_queue_size(queue):
-    return MAX_QUEUE_SIZE_PER_WORKER * max(Worker.count(queue=queue), 1)
+    return MAX_QUEUE_SIZE_PER_WORKER * get_worker_count(queue)
+
+
+@cached(cache=TTLCache(maxsize=1, ttl=60 * 60))
+def get_time_per_mp():
+    # the median of recent jobs, so that the estimates follow the hardware
+    rows = history.get_run_times(get_db())
+    time_per_mp = dict(scheduling.TIME_PER_MP)
+    for model in MODEL_QUEUES:
+        values = sorted(row['time'] / scheduling.get_work_megapixels(model, row['input_width'], row['input_height'])
+            for row in rows if row['meta'] == f'{model}_style_transfer' and row['time'] is not None)
+        if len(values) >= MIN_CALIBRATION_JOBS:
+            time_per_mp[model] = history.get_percentile(values, 50)
+    return time_per_mp
+
+
+@cached(cache=TTLCache(maxsize=len(MODEL_QUEUES), ttl=STATUS_UPDATE_INTERVAL))
+def get_queue_estimates(queue):
+    return queue.get_estimates(Worker.all(queue=queue))
+
+
+def get_job_estimate(job_queues, job):
+    # position and eta in seconds, from a snapshot shared by all clients, refreshed once per update interval
+    queue = job_queues.get(job.origin)
+    if queue is None:
+        return None, None
+    position, eta = get_queue_estimates(queue).get(job.id, (None, None))
+    if position is None:
+        position = queue.get_job_position(job)  # enqueued after the snapshot, or just dequeued
+    return position, round(eta) if eta is not None else None
 
 
 def get_db():
@@ -88,6 +129,7 @@ def configure(app):
         db = get_db()
         with current_app.open_resource('schema.sql') as f:
             db.executescript(f.read().decode('utf-8'))
+        history.rebuild_job_stats(db)
         click.echo('Initialized the database.')
 
     @app.teardown_appcontext
@@ -151,7 +193,8 @@ def configure(app):
         deduct_when=lambda response: response.status_code == 401)
 
     # RQ
-    job_queue = Queue(name=config.DEFAULT_QUEUE, connection=redis_client)
+    job_queues = {name: scheduling.Queue(name=name, connection=redis_client)
+        for name in [*MODEL_QUEUES.values(), config.LEGACY_QUEUE]}
     system_queue = Queue(name=config.SYSTEM_QUEUE, connection=redis_client)
     scheduler = Scheduler(queue=system_queue, connection=system_queue.connection)
     for job in scheduler.get_jobs():
@@ -160,11 +203,13 @@ def configure(app):
     start_time = datetime.utcnow()
     scheduler.schedule(start_time, 'worker.tasks.log_stats', description='log_stats', id='log_stats',
         interval=(60 * 60), timeout=30)
-    scheduler.schedule(start_time, 'worker.tasks.cleanup_data', description='cleanup_data',
-        args=[JOB_KWARGS['iterative']], id='cleanup_data', interval=(60 * 60), timeout=30)
+    scheduler.schedule(start_time, 'worker.tasks.cleanup_data', description='cleanup_data', id='cleanup_data',
+        interval=(60 * 60), timeout=30)
     scheduler.schedule(start_time + timedelta(minutes=1.1), 'worker.tasks.health_check', description='health_check',
         id=config.HEALTH_CHECK_JOB_ID, interval=config.HEALTH_CHECK_INTERVAL, timeout=30, at_front=True)
     scheduler.cron('0 3 * * *', 'worker.tasks.maintenance', description='maintenance', id='maintenance', timeout=30)
+    scheduler.cron('30 3 * * *', 'worker.tasks.reconcile_data', description='reconcile_data',
+        args=[JOB_KWARGS['iterative']], id='reconcile_data', timeout=(30 * 60))
 
     # RQ Dashboard
     app.config['RQ_DASHBOARD_REDIS_URL'] = redis_url
@@ -178,7 +223,7 @@ def configure(app):
     if USE_WEBSOCKET:
         wsapi.configure(app)
 
-    return app, auth, limiter, auth_limit, job_queue
+    return app, auth, limiter, auth_limit, redis_client, job_queues
 
 
 app_env = os.environ['APP_ENV']
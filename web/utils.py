@@ -1,15 +1,18 @@
+import os
 import time
+import shutil
 from functools import wraps
+from urllib.parse import quote
 import builtins
 import warnings
 
-from flask import make_response
+from flask import current_app, request, make_response, send_file
 from rq import Worker
 from rq.job import Job
 from rq.results import Result
 from rq.exceptions import NoSuchJobError
 
-from common import config
+from common import config, formats
 from . import settings
 
 
@@ -36,18 +39,79 @@ def filter_warnings(filters):
         warnings.filterwarnings(action, message, category, module, lineno)
 
 
-def check_health(app, job_queue):
+def link_file(src, dst):
+    try:
+        os.link(src, dst)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(src, dst)
+    os.utime(dst)  # postpone cleanup
+
+
+def link_result(src, dst):
+    try:
+        link_file(src, dst)
+    except FileNotFoundError:
+        return False
+    for thumbnail in [False, True]:
+        for ext in formats.FORMATS:
+            try:
+                link_file(formats.get_variant_path(src, ext, thumbnail), formats.get_variant_path(dst, ext, thumbnail))
+            except FileNotFoundError:
+                pass
+    return True
+
+
+def get_accepted_format(ext):
+    # require an explicit mime type, browsers without webp/avif support still send */* and image/*
+    accepted = {value for value, quality in request.accept_mimetypes if quality > 0}
+    if ext in formats.UNIVERSAL_FORMATS or formats.FORMATS[ext][1] in accepted:
+        return ext
+    return formats.FALLBACK_FORMAT
+
+
+def send_image(path, download_name=None, thumbnail=False):
+    # the worker saves the converted and resized variants next to the result, see common.formats.save_variants;
+    # there is no thumbnail of a small result
+    orig_ext = path.suffix[1:]
+    ext = get_accepted_format(orig_ext)
+    variant_paths = [formats.get_variant_path(path, ext, thumbnail=True)] if thumbnail else []
+    variant_paths.append(formats.get_variant_path(path, ext) if ext != orig_ext else path)
+    variant_path = next((p for p in variant_paths if p.exists()), path)
+    ext = variant_path.suffix[1:]
+    if download_name is not None:
+        download_name = f'{os.path.splitext(download_name)[0]}.{ext}'
+    mimetype = formats.FORMATS[ext][1]
+    if request.headers.get('X-Sendfile-Type') == 'X-Accel-Redirect':
+        # nginx serves the file with etag, conditional and range support, and adds Vary
+        rel_path = variant_path.relative_to(settings.get_jobs_dir(current_app))
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = settings.X_ACCEL_LOCATION + quote(rel_path.as_posix())
+        response.mimetype = mimetype
+        if download_name is not None:
+            response.headers.set('Content-Disposition', 'inline', filename=download_name)
+    else:
+        response = send_file(variant_path, mimetype=mimetype, download_name=download_name)
+        response.vary.add('Accept')
+    response.headers['Cache-Control'] = settings.IMAGE_CACHE_CONTROL
+    return response
+
+
+def check_health(app, job_queues):
     # log warnings because the endpoint is monitored and has an alert
     start_time = time.time()
-    if len(job_queue) >= settings.get_max_queue_size(job_queue) // 2:
-        app.logger.warning('Health check failed: queue size is too large.')
-        return False
-    if len([w for w in Worker.all(job_queue.connection) if w.get_state() in ['idle', 'busy']]) < 1:
-        app.logger.warning('Health check failed: no workers are available.')
-        return False
+    connection = next(iter(job_queues.values())).connection
+    for job_queue in job_queues.values():
+        if len(job_queue) >= settings.get_max_queue_size(job_queue) // 2:
+            app.logger.warning('Health check failed: queue %s size is too large.', job_queue.name)
+            return False
+        if len([w for w in Worker.all(queue=job_queue) if w.get_state() in ['idle', 'busy']]) < 1:
+            app.logger.warning('Health check failed: no workers are available for queue %s.', job_queue.name)
+            return False
     for job_id in [config.HEALTH_CHECK_JOB_ID, config.IMAGE_CHECK_JOB_ID]:
         try:
-            job = Job.fetch(job_id, job_queue.connection)
+            job = Job.fetch(job_id, connection)
         except NoSuchJobError:
             app.logger.warning('Health check failed: job %s does not exist.', job_id)
             return False
@@ -1,14 +1,22 @@
 import time
 import json
 import socket
+import logging
+from contextlib import contextmanager
 
 from flask import request
 from simple_websocket import Server, ConnectionClosed
+from rq.exceptions import NoSuchJobError
+import gevent
+from gevent.queue import Queue, Empty
 import wrapt
 
 from web import settings
 
 
+logger = logging.getLogger(__name__)
+
+
 class WebSocketServer(Server):
     class SocketProxy(wrapt.ObjectProxy):
         def close(self):
@@ -27,18 +35,87 @@ class WebSocketServer(Server):
         self.sock.shutdown(socket.SHUT_WR)  # prevent sending http headers
 
 
+class JobEvents:
+    # one pubsub connection per process, shared by all listeners
+    RECONNECT_DELAY = 1
+
+    def __init__(self, connection):
+        db = connection.connection_pool.connection_kwargs.get('db', 0)
+        self.prefix = f'__keyspace@{db}__:'
+        self.pubsub = connection.pubsub()
+        self.listeners = {}
+        self.dispatcher = gevent.spawn(self.dispatch)
+
+    def dispatch(self):
+        while True:
+            try:
+                message = self.pubsub.get_message(timeout=settings.STATUS_UPDATE_HEARTBEAT)
+            except Exception as e:
+                logger.warning('Job events connection failed: %s', e)
+                gevent.sleep(self.RECONNECT_DELAY)
+                for listeners in list(self.listeners.values()):
+                    self.notify(listeners)  # events may have been missed
+                continue
+            if message is None or message['type'] not in {'message', 'subscribe'}:
+                continue
+            listeners = self.listeners.get(message['channel'].decode())
+            if listeners:
+                self.notify(listeners)
+
+    @staticmethod
+    def notify(listeners):
+        for queue in list(listeners):
+            queue.put(None)
+
+    @contextmanager
+    def listen(self, job):
+        channel = self.prefix + job.key.decode()
+        queue = Queue()
+        listeners = self.listeners.setdefault(channel, set())
+        listeners.add(queue)
+        try:
+            if len(listeners) == 1:
+                self.pubsub.subscribe(channel)  # the confirmation triggers an initial status fetch
+            else:
+                queue.put(None)
+            yield queue
+        finally:
+            listeners.discard(queue)
+            if not listeners and self.listeners.get(channel) is listeners:
+                del self.listeners[channel]
+                self.pubsub.unsubscribe(channel)
+
+
+job_events = None
+
+
+def get_job_events(connection):
+    global job_events
+    if job_events is None:
+        job_events = JobEvents(connection)
+    return job_events
+
+
 def listen(job_id):
-    from app import app, job_queue, get_job_or_abort
+    from app import app, redis_client, job_queues, get_job_or_abort
 
     def update_status(refresh):
         nonlocal state, last_send
         terminal_status = {'finished', 'failed', 'canceled', 'stopped'}
-        status = job.get_status(refresh=refresh)
-        position = job_queue.get_job_position(job) if status == 'queued' else None
-        cur_state = (status, position)
+        if refresh:
+            try:
+                job.refresh()  # a single round trip for both status and progress
+                status = job.get_status(refresh=False)
+            except NoSuchJobError:
+                status = None
+        else:
+            status = job.get_status(refresh=False)
+        position, eta = settings.get_job_estimate(job_queues, job) if status == 'queued' else (None, None)
+        progress = job.meta.get('progress') if status == 'started' else None
+        cur_state = (status, position, eta, progress)
         if cur_state != state or time.time() - last_send >= settings.STATUS_UPDATE_HEARTBEAT:
             app.logger.info('Job status: %s', status)
-            ws.send(json.dumps({'status': status, 'position': position}))
+            ws.send(json.dumps({'status': status, 'position': position, 'eta': eta, 'progress': progress}))
             state = cur_state
             last_send = time.time()
         return status is not None and status not in terminal_status
@@ -46,16 +123,13 @@ def listen(job_id):
     start_time = time.time()
     job = get_job_or_abort(job_id)
     end_time = start_time + job.ttl + job.timeout
-    state = (None, None)
+    state = (None, None, None, None)
     last_send = 0.0
     app.logger.info('Listen: %s', job_id)
     ws = WebSocketServer(request.environ, ping_interval=settings.WEBSOCKET_PING_INTERVAL, max_message_size=128)
     try:
         if update_status(False):
-            pubsub = job_queue.connection.pubsub()  # no ignore_subscribe_messages to trigger an initial status fetch
-            try:
-                db = job_queue.connection.connection_pool.connection_kwargs.get('db', 0)
-                pubsub.subscribe(f'__keyspace@{db}__:{job.key.decode()}')
+            with get_job_events(redis_client).listen(job) as events:
                 while True:
                     cur_time = time.time()
                     if cur_time >= end_time:
@@ -65,14 +139,18 @@ def listen(job_id):
                         break
                     next_time = max(min(end_time, last_send + settings.STATUS_UPDATE_HEARTBEAT), cur_time)
                     timeout = min(next_time - cur_time, settings.STATUS_UPDATE_INTERVAL)  # poll for queue position
-                    message = pubsub.get_message(timeout=timeout)
-                    if not update_status(message is not None):
+                    try:
+                        events.get(timeout=timeout)
+                        while not events.empty():
+                            events.get_nowait()
+                        refresh = True
+                    except Empty:
+                        refresh = False
+                    if not update_status(refresh):
                         break
                     data = ws.receive(timeout=0)
                     if data is not None:
                         break
-            finally:
-                pubsub.close()
     except ConnectionClosed:
         pass
     finally:
@@ -0,0 +1,145 @@
+import os
+import socket
+import hashlib
+import logging
+from pathlib import Path
+
+from cachetools import LRUCache
+
+from redis import RedisError
+
+from common import NAME, config
+
+
+CACHE_DIR = Path(__file__).parent.parent / 'data' / config.CACHE_DIR
+STATS_KEY = f'{NAME}:cache_stats'
+
+
+logger = logging.getLogger(__name__)
+
+caches = {}
+
+
+def publish_stats(redis_client):
+    # the counters are per worker process, log_stats reads and resets the totals
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    try:
+        with redis_client.pipeline() as pipeline:
+            for name, cache in caches.items():
+                pipeline.hincrby(STATS_KEY, f'{name}:hits', cache.hits)
+                pipeline.hincrby(STATS_KEY, f'{name}:misses', cache.misses)
+                pipeline.hset(STATS_KEY, f'{name}:entries:{worker}', len(cache))
+            pipeline.execute()
+    except RedisError as e:
+        logger.warning('Failed to publish cache stats: %s', e)
+        return
+    for cache in caches.values():
+        cache.hits = cache.misses = 0
+
+
+def get_stats(redis_client):
+    with redis_client.pipeline() as pipeline:
+        pipeline.hgetall(STATS_KEY)
+        pipeline.delete(STATS_KEY)
+        values, _ = pipeline.execute()
+    stats = {}
+    for field, value in values.items():
+        name, counter, *_ = field.decode().split(':')
+        cache_stats = stats.setdefault(name, {'hits': 0, 'misses': 0, 'entries': 0, 'workers': 0})
+        cache_stats[counter] += int(value)
+        if counter == 'entries':
+            cache_stats['workers'] += 1
+    return stats
+
+
+def get_image_key(image, *params):
+    digest = hashlib.sha256()
+    digest.update(repr((image.mode, image.size, params)).encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    def __init__(self, name, max_size, getsizeof, disk_max_size=0, load=None, dump=None):
+        self.name = name
+        self.memory = LRUCache(maxsize=max_size, getsizeof=getsizeof)
+        self.disk_dir = CACHE_DIR / name if disk_max_size else None
+        self.disk_max_size = disk_max_size
+        self.load = load
+        self.dump = dump
+        self.hits = 0
+        self.misses = 0
+        caches[name] = self
+
+    def __len__(self):
+        return len(self.memory)
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.disk_dir is not None:
+            value = self.disk_get(key)
+            if value is not None:
+                self.memory_put(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.memory_put(key, value)
+        if self.disk_dir is not None:
+            self.disk_put(key, value)
+
+    def memory_put(self, key, value):
+        try:
+            self.memory[key] = value
+        except ValueError:  # larger than the whole cache
+            pass
+
+    def disk_get(self, key):
+        path = self.disk_dir / key
+        try:
+            with open(path, 'rb') as f:
+                value = self.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning('Failed to load cache entry %s/%s: %s', self.name, key, e)
+            path.unlink(missing_ok=True)
+            return None
+        return value
+
+    def disk_put(self, key, value):
+        path = self.disk_dir / key
+        tmp_path = path.with_name(f'{key}.{os.getpid()}.tmp')
+        try:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                self.dump(value, f)
+            os.replace(tmp_path, path)
+            self.disk_evict()
+        except Exception as e:
+            logger.error('Failed to store cache entry %s/%s: %s', self.name, key, e)
+            tmp_path.unlink(missing_ok=True)
+
+    def disk_evict(self):
+        entries = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith('.tmp'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.disk_max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
@@ -0,0 +1,38 @@
+import os
+import logging
+import threading
+
+
+FILENAME = 'checkpoint.pt'
+
+
+logger = logging.getLogger(__name__)
+
+drain = threading.Event()  # set on a warm shutdown, see conf/worker.py
+
+
+class Interrupted(Exception):
+    pass
+
+
+def save(path, state):
+    import torch
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    try:
+        torch.save(state, tmp_path)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.error('Failed to save checkpoint %s: %s', path, e)
+        tmp_path.unlink(missing_ok=True)
+
+
+def load(path, device=None):
+    import torch
+    try:
+        return torch.load(path, map_location=device, weights_only=True)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning('Failed to load checkpoint %s: %s', path, e)
+        return None
+
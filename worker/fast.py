@@ -1,11 +1,150 @@
+import os
+import re
+import time
+import hashlib
+import logging
+
 import numpy as np
 import tensorflow as tf
+from tensorflow.python.framework.convert_to_constants import convert_variables_to_constants_v2
 from PIL import Image
 
 from . import weights
+from .cache import CACHE_DIR, FeatureCache, get_image_key
+
+
+STYLE_BOTTLENECK_PATTERN = re.compile(r'(^|/)bottleneck/BiasAdd$')
+STYLE_CACHE_SIZE_MB = 1  # 400 bytes per style
+STYLE_CACHE_DISK_SIZE_MB = 16  # 0 to disable
+BACKEND = os.getenv('FAST_BACKEND', 'tf')  # tf, tflite, tflite-fp16 or tflite-int8
+QUANTIZATIONS = ['fp16', 'int8']  # int8 weights with dynamic range activations
+COMPILED_DIR = CACHE_DIR / 'compiled'
+
+
+logger = logging.getLogger(__name__)
+
+
+def wrap_frozen_graph(graph_def, inputs, outputs):
+    def import_graph_def():
+        tf.compat.v1.import_graph_def(graph_def, name='')
+
+    wrapped_import = tf.compat.v1.wrap_function(import_graph_def, [])
+    graph = wrapped_import.graph
+    return wrapped_import.prune(tf.nest.map_structure(graph.as_graph_element, inputs),
+        tf.nest.map_structure(graph.as_graph_element, outputs))
+
+
+def split_model(model):
+    spec = tf.TensorSpec([None, None, None, 3], tf.float32)
+    func = convert_variables_to_constants_v2(model.__call__.get_concrete_function(spec, spec))
+    graph_def = func.graph.as_graph_def()
+    content_input, style_input = [t.name for t in func.inputs]
+    output = func.outputs[0].name
+    bottlenecks = [op.outputs[0].name for op in func.graph.get_operations()
+        if STYLE_BOTTLENECK_PATTERN.search(op.name)]
+    if len(bottlenecks) != 1:
+        raise ValueError(f'Expected 1 style bottleneck, found {len(bottlenecks)}.')
+    predict = wrap_frozen_graph(graph_def, [style_input], bottlenecks[0])
+    transfer = wrap_frozen_graph(graph_def, [content_input, bottlenecks[0]], output)
+    return predict, transfer
+
+
+def convert_function(func, quantization):
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([func])
+    if quantization is not None:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'fp16':
+        converter.target_spec.supported_types = [tf.float16]
+    return converter.convert()
+
+
+def get_convert_key(quantization):
+    return hashlib.sha256(repr((tf.__version__, weights.HUB_MODEL_URL, quantization)).encode()).hexdigest()
+
+
+def convert_model(quantization):
+    variant = quantization or 'fp32'
+    key = get_convert_key(quantization)
+    paths = [COMPILED_DIR / f'style_{part}_{variant}-{key}.tflite' for part in ['predict', 'transfer']]
+    if all(path.exists() for path in paths):
+        return [{'model_path': str(path)} for path in paths]  # memory mapped
+
+    start_time = time.time()
+    models = [convert_function(func, quantization) for func in split_model(weights.get_hub_model())]
+    logger.info('Converted the style model to tflite (%s) in %.1f seconds.', variant, time.time() - start_time)
+    for path, content in zip(paths, models):
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        try:
+            COMPILED_DIR.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_bytes(content)
+            os.replace(tmp_path, path)
+            for stale_path in COMPILED_DIR.glob(path.name.replace(key, '*')):
+                if stale_path != path:
+                    stale_path.unlink(missing_ok=True)
+        except OSError as e:
+            logger.error('Failed to store converted style model: %s', e)
+            tmp_path.unlink(missing_ok=True)
+    return [{'model_content': content} for content in models]
 
 
-model = weights.get_hub_model()
+class LiteFunction:
+    def __init__(self, **kwargs):
+        num_threads = tf.config.threading.get_intra_op_parallelism_threads() or len(os.sched_getaffinity(0))
+        self.interpreter = tf.lite.Interpreter(num_threads=num_threads, **kwargs)
+        self.inputs = [d['index'] for d in self.interpreter.get_input_details()]
+        self.output = self.interpreter.get_output_details()[0]['index']
+        self.shapes = None
+
+    def __call__(self, *args):
+        args = [np.asarray(a, dtype=np.float32) for a in args]
+        shapes = [a.shape for a in args]
+        if shapes != self.shapes:
+            for index, shape in zip(self.inputs, shapes):
+                self.interpreter.resize_tensor_input(index, shape)
+            self.interpreter.allocate_tensors()
+            self.shapes = shapes
+        for index, a in zip(self.inputs, args):
+            self.interpreter.set_tensor(index, a)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output)
+
+
+class TFBackend:
+    name = 'tf'
+
+    def __init__(self):
+        self.model = weights.get_hub_model()
+        try:
+            self.predict_style, self.transfer_style = split_model(self.model)
+        except Exception as e:
+            logger.warning('Failed to split the model, style caching disabled: %s', e)
+            self.predict_style, self.transfer_style = None, None
+
+
+class LiteBackend:
+    model = None
+
+    def __init__(self, quantization=None):
+        self.name = f'tflite-{quantization}' if quantization else 'tflite'
+        self.predict_style, self.transfer_style = [LiteFunction(**kwargs) for kwargs in convert_model(quantization)]
+
+
+def get_backend(name):
+    engine, _, quantization = name.partition('-')
+    if engine == 'tflite' and (not quantization or quantization in QUANTIZATIONS):
+        try:
+            return LiteBackend(quantization or None)
+        except Exception as e:
+            logger.warning('Failed to load the %s backend, using tf: %s', name, e)
+    elif name != 'tf':
+        raise ValueError(f'Unknown fast backend: {name}')
+    return TFBackend()
+
+
+backend = get_backend(BACKEND)
+
+style_cache = FeatureCache('style_bottlenecks', STYLE_CACHE_SIZE_MB * 1024 * 1024, getsizeof=lambda a: a.nbytes,
+    disk_max_size=STYLE_CACHE_DISK_SIZE_MB * 1024 * 1024, load=np.load, dump=lambda a, f: np.save(f, a))
 
 
 def to_tensor(image):
@@ -25,9 +164,28 @@ def blend_images(content, output, alpha):
     return alpha * output + (1 - alpha) * content
 
 
+def get_style_bottleneck(style_image):
+    key = get_image_key(style_image, backend.name)
+    bottleneck = style_cache.get(key)
+    if bottleneck is None:
+        bottleneck = np.asarray(backend.predict_style(to_tensor(style_image)[tf.newaxis, :]))
+        style_cache.put(key, bottleneck)
+    else:
+        logger.info('Using cached style bottleneck.')
+    return bottleneck
+
+
+def style_transfer_batch(content_images, style_images, strengths):
+    content_tensor = tf.stack([to_tensor(image) for image in content_images])
+    if backend.transfer_style is not None:
+        bottleneck = np.concatenate([get_style_bottleneck(image) for image in style_images])
+        outputs = backend.transfer_style(content_tensor, tf.constant(bottleneck))
+    else:
+        outputs = [backend.model(content_tensor[i:i + 1], to_tensor(image)[tf.newaxis, :])[0][0]
+            for i, image in enumerate(style_images)]
+    return [to_image(blend_images(content, output, strength / 100))
+        for content, output, strength in zip(content_tensor, outputs, strengths)]
+
+
 def style_transfer(content_image, style_image, strength):
-    content_image = to_tensor(content_image)[tf.newaxis, :]
-    style_image = to_tensor(style_image)[tf.newaxis, :]
-    output = model(content_image, style_image)[0][0]
-    output = blend_images(content_image[0], output, strength / 100)
-    return to_image(output)
+    return style_transfer_batch([content_image], [style_image], [strength])[0], {}
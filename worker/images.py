@@ -0,0 +1,40 @@
+from PIL import Image
+
+from common import formats
+
+
+REDUCING_GAP = 2  # keep at least this much oversampling before the final resize
+REDUCE_MODES = {'L', 'LA', 'RGB', 'RGBA'}
+
+
+def get_scaled_size(size, max_size):
+    long_edge = max(size)
+    if long_edge <= max_size:
+        return size
+    scale = max_size / long_edge
+    return tuple(max(round(s * scale), 1) for s in size)
+
+
+def load_image(image_path, max_size):
+    with Image.open(image_path) as image:
+        size = get_scaled_size(image.size, max_size)
+        if size != image.size:
+            image.draft('RGB', size)  # DCT scaling, JPEG only
+            factor = min(s // (t * REDUCING_GAP) for s, t in zip(image.size, size))
+            if factor > 1 and image.mode in REDUCE_MODES:
+                image = image.reduce(factor)
+        image = image.convert('RGB')
+    if image.size != size:
+        image = image.resize(size, resample=Image.Resampling.BILINEAR)
+    return image
+
+
+def get_image_size(image_path):
+    with Image.open(image_path) as image:
+        return image.size
+
+
+def save_image(image, result_path):
+    formats.save_image(image, result_path)
+    formats.save_variants(image, result_path)
+    return image.size
@@ -1,4 +1,9 @@
+import os
+import time
+import hashlib
 import logging
+import functools
+from typing import List
 
 import torch
 import torch.nn as nn
@@ -7,7 +12,8 @@ import torch.optim as optim
 
 import torchvision.transforms as transforms
 
-from . import weights
+from . import weights, checkpoints
+from .cache import CACHE_DIR, FeatureCache, get_image_key
 
 
 NUM_STEPS = 320
@@ -19,6 +25,23 @@ MAX_STYLE_WEIGHT = 1_000_000
 CONTENT_WEIGHT = 1
 TV_WEIGHT = 5e-6
 NOISE = 0.1, 0.45  # scaling reduces losses a tiny bit
+USE_PYRAMID = False
+USE_FOURIER = False  # optimize a color-decorrelated, frequency-scaled spectrum instead of the pixels
+FOURIER_DECAY = 1  # of the frequency scaling, 0 for a plain spectrum
+COLOR_CORRELATION = [[0.26, 0.09, 0.02], [0.27, 0.00, -0.05], [0.27, -0.09, 0.03]]  # square root, from imagenet
+PYRAMID_SCALES = [0.25, 0.5, 1]
+PYRAMID_STEPS = [160, 100, 60]  # most steps on the cheap scales
+PYRAMID_MIN_SIZE = 32
+CONVERGENCE_MIN_STEPS = 100  # at most half of the steps of a pyramid stage
+CONVERGENCE_WINDOW = 20
+CONVERGENCE_TOLERANCE = 1e-3  # relative loss improvement over the window
+CHECKPOINT_STEPS = 10  # l-bfgs iterations between checkpoints, also the latency of a drain
+STYLE_CACHE_SIZE_MB = 64  # about 2.4 MB per style
+STYLE_CACHE_DISK_SIZE_MB = 512  # 0 to disable
+USE_CHANNELS_LAST = False
+USE_BF16 = False  # autocast the cnn where supported, gram matrices and losses stay in fp32
+USE_COMPILED_EXTRACTOR = True  # torchscript, cached on disk
+COMPILED_DIR = CACHE_DIR / 'compiled'
 
 
 logger = logging.getLogger(__name__)
@@ -30,60 +53,195 @@ cnn = weights.get_vgg_model().features.eval().requires_grad_(False)
 cnn_normalization_mean = torch.tensor([0.485, 0.456, 0.406])
 cnn_normalization_std = torch.tensor([0.229, 0.224, 0.225])
 
+color_transform = torch.tensor(COLOR_CORRELATION)
+color_transform /= color_transform.norm(dim=0).max()
+
 to_tensor = transforms.ToTensor()
 to_image = transforms.ToPILImage()
 convert_image = lambda image: to_tensor(image).to(device)
 
+style_cache = FeatureCache('style_targets', STYLE_CACHE_SIZE_MB * 1024 * 1024,
+    getsizeof=lambda targets: sum(t.element_size() * t.nelement() for t in targets),
+    disk_max_size=STYLE_CACHE_DISK_SIZE_MB * 1024 * 1024,
+    load=lambda f: torch.load(f, map_location=device, weights_only=True), dump=torch.save)
 
-def gram_matrix(input):
-    a, b, c, d = input.size()
-    features = input.view(b, c * d)
-    G = features @ features.t()
-    return G / (b * c * d)
 
+class StopOptimization(Exception):
+    pass
 
-class ContentLoss(nn.Module):
-    def __init__(self, target):
-        super().__init__()
-        self.target = target
 
-    def forward(self, input):
-        if input.size() == self.target.size():
-            self.loss = F.mse_loss(input, self.target)
-        else:
-            self.loss = torch.tensor(0)
-        return input
+def is_bf16_supported():
+    if device.type == 'cuda':
+        return torch.cuda.is_bf16_supported()
+    return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
 
 
-class StyleLoss(nn.Module):
-    def __init__(self, target_feature):
-        super().__init__()
-        self.target = gram_matrix(target_feature)
+def use_bf16():
+    return USE_BF16 and is_bf16_supported()
 
-    def forward(self, input):
-        G = gram_matrix(input)
-        self.loss = F.mse_loss(G, self.target)
-        return input
 
+def autocast():
+    return torch.autocast(device.type, dtype=torch.bfloat16, enabled=use_bf16())
 
-class TotalVariationLoss(nn.Module):
-    def __call__(self, input):
-        dx = input[:, :, :, 1:] - input[:, :, :, :-1]
-        dy = input[:, :, 1:, :] - input[:, :, :-1, :]
-        loss = torch.sum(torch.abs(dx)) + torch.sum(torch.abs(dy)) / (dx.numel() + dy.numel())
-        return loss
+
+def to_memory_format(image):
+    return image.contiguous(memory_format=torch.channels_last) if USE_CHANNELS_LAST else image
+
+
+def is_channels_last(input):
+    return input.is_contiguous(memory_format=torch.channels_last) and not input.is_contiguous()
+
+
+def as_matrices(input):
+    # (channels, pixels) and its transpose, as views in either memory format
+    a, b, c, d = input.size()
+    if is_channels_last(input):
+        transposed = input.permute(0, 2, 3, 1).reshape(c * d, b)
+        return transposed.t(), transposed
+    matrix = input.view(b, c * d)
+    return matrix, matrix.t()
+
+
+def gram_matrix(input):
+    a, b, c, d = input.size()
+    with torch.autocast(device.type, enabled=False):
+        matrix, transposed = as_matrices(input.float())
+        G = matrix @ transposed
+    return G / (b * c * d)
+
+
+class FusedLossFunction(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, loss, image, *features):
+        ctx.loss = loss
+        return loss.forward(image, features)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        return None, *ctx.loss.backward(grad_output)
+
+
+class FusedLoss:
+    # content, style and tv losses in one autograd node with analytic gradients and buffers reused across steps;
+    # the gram residual is symmetric, so its gradient takes one matmul instead of two
+    def __init__(self, content_targets, style_targets, content_weight, style_weight, tv_weight):
+        self.content_targets = [t.float().contiguous() for t in content_targets]
+        self.style_targets = style_targets
+        self.weights = content_weight, style_weight, tv_weight
+        self.buffers = None
+        self.saved = None
+
+    def __call__(self, image, content_features, style_features):
+        # the weighted content, style and tv losses
+        return FusedLossFunction.apply(self, image, *content_features, *style_features)
+
+    def allocate(self, image, content_features, style_features):
+        content_weight, style_weight, tv_weight = self.weights
+        dx = torch.empty(image[..., 1:].shape)
+        dy = torch.empty(image[..., 1:, :].shape)
+        scales = torch.zeros(3, len(content_features) + len(style_features) + 2)
+        for i, t in enumerate(self.content_targets):
+            scales[0, i] = content_weight / t.numel()
+        for i, t in enumerate(self.style_targets, len(self.content_targets)):
+            scales[1, i] = style_weight / t.numel()
+        scales[2, -2] = tv_weight
+        scales[2, -1] = tv_weight / (dx.numel() + dy.numel())
+        self.buffers = {
+            'content_residuals': [torch.empty(t.shape) for t in self.content_targets],
+            'style_residuals': [torch.empty(t.shape) for t in self.style_targets],
+            'content_grads': [torch.empty(f.shape) for f in content_features],
+            'style_grads': [torch.empty(as_matrices(f)[1 if is_channels_last(f) else 0].shape) for f in style_features],
+            'dx': dx, 'dy': dy, 'image_grad': torch.empty(image.shape),
+            'losses': torch.empty(scales.shape[1]), 'scales': scales,
+        }
+
+    def forward(self, image, features):
+        content_features = features[:len(self.content_targets)]
+        style_features = features[len(self.content_targets):]
+        if self.buffers is None:
+            self.allocate(image, content_features, style_features)
+        buffers = self.buffers
+        losses = buffers['losses'].unbind()
+        for f, t, r, loss in zip(content_features, self.content_targets, buffers['content_residuals'], losses):
+            torch.sub(f, t, out=r)
+            torch.dot(r.view(-1), r.view(-1), out=loss)
+        matrices = [as_matrices(f.float()) for f in style_features]
+        for (m, mt), t, r, loss in zip(matrices, self.style_targets, buffers['style_residuals'],
+                losses[len(content_features):]):
+            torch.addmm(t, m, mt, beta=-1, alpha=1 / m.numel(), out=r)  # the gram matrix minus its target
+            torch.dot(r.view(-1), r.view(-1), out=loss)
+        torch.sub(image[..., 1:], image[..., :-1], out=buffers['dx'])
+        torch.sub(image[..., 1:, :], image[..., :-1, :], out=buffers['dy'])
+        torch.linalg.vector_norm(buffers['dx'], 1, out=losses[-2])
+        torch.linalg.vector_norm(buffers['dy'], 1, out=losses[-1])
+        self.saved = [(f.shape, is_channels_last(f)) for f in style_features], [f.dtype for f in features], matrices
+        return torch.mv(buffers['scales'], buffers['losses'])
+
+    def backward(self, grad_output):
+        buffers = self.buffers
+        layouts, dtypes, matrices = self.saved
+        self.saved = None
+        scales = (buffers['scales'] * grad_output[:, None]).sum(0)
+        grads = []
+        for r, g, scale in zip(buffers['content_residuals'], buffers['content_grads'], scales):
+            grads.append(torch.mul(r, 2 * scale, out=g))
+        for (m, mt), (shape, channels_last), r, g, scale in zip(matrices, layouts, buffers['style_residuals'],
+                buffers['style_grads'], scales[len(grads):]):
+            r.mul_(4 * scale / m.numel())
+            if channels_last:
+                a, b, c, d = shape
+                grads.append(torch.mm(mt, r, out=g).view(a, c, d, b).permute(0, 3, 1, 2))
+            else:
+                grads.append(torch.mm(r, m, out=g).view(shape))
+        image_grad = buffers['image_grad'].zero_()
+        for diff, scale, dim in [(buffers['dx'], scales[-2], -1), (buffers['dy'], scales[-1], -2)]:
+            diff.sign_().mul_(scale)
+            image_grad.narrow(dim, 1, diff.shape[dim]).add_(diff)
+            image_grad.narrow(dim, 0, diff.shape[dim]).sub_(diff)
+        return image_grad, *[g.to(dtype) for g, dtype in zip(grads, dtypes)]
+
+
+class FourierImage:
+    # the image is reconstructed through a sigmoid, which keeps the pixels in range without clamping
+    def __init__(self, image):
+        self.size = h, w = image.shape[-2:]
+        frequencies = torch.sqrt(torch.fft.fftfreq(h)[:, None] ** 2 + torch.fft.rfftfreq(w) ** 2)
+        self.scale = 1 / frequencies.clamp(min=1 / max(h, w)) ** FOURIER_DECAY
+        image = torch.einsum('ij,bjhw->bihw', torch.linalg.inv(color_transform), torch.logit(image.detach(), 1e-4))
+        self.params = torch.view_as_real(torch.fft.rfft2(image, norm='ortho') / self.scale).clone()
+
+    def __call__(self):
+        image = torch.fft.irfft2(torch.view_as_complex(self.params) * self.scale, s=self.size, norm='ortho')
+        return torch.sigmoid(torch.einsum('ij,bjhw->bihw', color_transform, image))
 
 
 class Normalization(nn.Module):
     def __init__(self, mean, std):
         super().__init__()
-        self.mean = mean.view(-1, 1, 1)
-        self.std = std.view(-1, 1, 1)
+        self.register_buffer('mean', mean.view(-1, 1, 1))
+        self.register_buffer('std', std.view(-1, 1, 1))
 
     def forward(self, img):
         return (img - self.mean) / self.std
 
 
+class FeatureExtractor(nn.Module):
+    def __init__(self, layers, outputs):
+        super().__init__()
+        self.normalization = Normalization(cnn_normalization_mean, cnn_normalization_std)
+        self.layers = nn.ModuleList(layers)
+        self.outputs = outputs
+
+    def forward(self, input: torch.Tensor) -> List[torch.Tensor]:
+        features = []
+        x = self.normalization(input)
+        for i, layer in enumerate(self.layers):
+            x = layer(x)
+            if i in self.outputs:
+                features.append(x)
+        return features
+
+
 def get_layers():
     block = 1
     conv = 0
@@ -106,96 +264,246 @@ def get_layers():
         yield name, layer
 
 
-def get_style_model_and_losses(content_image, style_image):
-    normalization = Normalization(cnn_normalization_mean, cnn_normalization_std)
-    model = nn.Sequential(normalization)
-
-    content_target = model(content_image)
-    style_target = model(style_image)
-
-    content_losses = []
-    style_losses = []
-
-    c = 1
-    s = 1
-    for name, layer in get_layers():
-        model.add_module(name, layer)
-
-        content_target = layer(content_target)
-        style_target = layer(style_target)
-
-        if name in CONTENT_LAYERS:
-            content_loss = ContentLoss(content_target)
-            model.add_module(f'content_loss_{c}', content_loss)
-            content_losses.append(content_loss)
-            c += 1
-
-        if name in STYLE_LAYERS:
-            style_loss = StyleLoss(style_target)
-            model.add_module(f'style_loss_{s}', style_loss)
-            style_losses.append(style_loss)
-            s += 1
-
-    last = -1
-    for i, layer in enumerate(model):
-        if isinstance(layer, (ContentLoss, StyleLoss)):
-            last = i
-    model = model[:last + 1]
-
-    return model, content_losses, style_losses
-
-
-def run_style_transfer(content_image, style_image, content_weight, style_weight, tv_weight):
-    model, content_losses, style_losses = get_style_model_and_losses(content_image, style_image)
-
-    work_image = torch.rand(content_image.size()) * NOISE[0] + NOISE[1]
-    work_image.requires_grad_(True)
-
-    model.eval()
-
-    optimizer = optim.LBFGS([work_image], lr=LEARNING_RATE, max_iter=NUM_STEPS, **LBFGS_KWARGS)
-    tv_loss_fn = TotalVariationLoss()
+def get_compile_key(extractor):
+    digest = hashlib.sha256(repr((torch.__version__, str(extractor), extractor.outputs)).encode())
+    for tensor in extractor.state_dict().values():
+        digest.update(tensor.cpu().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def compile_extractor(extractor):
+    path = COMPILED_DIR / f'feature_extractor-{get_compile_key(extractor)}.pt'
+    if path.exists():
+        try:
+            compiled = torch.jit.load(path, map_location=device)
+            logger.info('Loaded compiled feature extractor.')
+            return compiled
+        except Exception as e:
+            logger.warning('Failed to load compiled feature extractor: %s', e)
+
+    start_time = time.time()
+    compiled = torch.jit.script(extractor)
+    logger.info('Compiled feature extractor in %.1f seconds.', time.time() - start_time)
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    try:
+        COMPILED_DIR.mkdir(parents=True, exist_ok=True)
+        torch.jit.save(compiled, tmp_path)
+        os.replace(tmp_path, path)
+        for stale_path in COMPILED_DIR.glob('feature_extractor-*.pt'):
+            if stale_path != path:
+                stale_path.unlink(missing_ok=True)
+    except OSError as e:
+        logger.error('Failed to store compiled feature extractor: %s', e)
+        tmp_path.unlink(missing_ok=True)
+    return compiled
+
+
+def get_feature_extractor():
+    names, layers = zip(*get_layers())
+    outputs = [i for i, name in enumerate(names) if name in CONTENT_LAYERS or name in STYLE_LAYERS]
+    extractor = FeatureExtractor(layers, outputs).eval().requires_grad_(False)
+    if USE_COMPILED_EXTRACTOR:
+        extractor = compile_extractor(extractor)
+    return extractor, [names[i] for i in outputs]
+
+
+def set_memory_format():
+    extractor.to(memory_format=torch.channels_last if USE_CHANNELS_LAST else torch.contiguous_format)  # in place
+
+
+def extract_features(image, layers):
+    with autocast():
+        features = extractor(to_memory_format(image))
+    return [[f for name, f in zip(feature_names, features) if name in names] for names in layers]
+
+
+def get_style_targets(style_image):
+    set_memory_format()
+    style_features, = extract_features(style_image, [STYLE_LAYERS])
+    return [gram_matrix(f) for f in style_features]
+
+
+def get_cached_style_targets(style_image):
+    key = get_image_key(style_image, STYLE_LAYERS, use_bf16())
+    style_targets = style_cache.get(key)
+    if style_targets is None:
+        style_targets = get_style_targets(convert_image(style_image).unsqueeze(0))
+        style_cache.put(key, style_targets)
+    else:
+        logger.info('Using cached style targets.')
+    return style_targets
+
+
+def resize_image(image, size):
+    if list(image.shape[-2:]) == size:
+        return image
+    return F.interpolate(image, size=size, mode='bilinear', align_corners=False, antialias=True)
+
+
+def check_convergence(step, num_steps, losses, deadline):
+    if deadline is not None and time.time() >= deadline:
+        raise StopOptimization('time_budget')
+    if step >= min(CONVERGENCE_MIN_STEPS, num_steps // 2) and len(losses) > CONVERGENCE_WINDOW:
+        prev_loss = min(losses[:-CONVERGENCE_WINDOW])
+        cur_loss = min(losses)
+        if prev_loss - cur_loss < CONVERGENCE_TOLERANCE * prev_loss:
+            raise StopOptimization('converged')
+
+
+def optimize(content_image, style_targets, work_image, num_steps, content_weight, style_weight, tv_weight,
+        deadline=None, callback=None, checkpoint=None, resume=None):
+    set_memory_format()
+    content_targets, = extract_features(content_image, [CONTENT_LAYERS])
+
+    if USE_FOURIER:
+        get_image = FourierImage(work_image)
+        params = get_image.params
+    else:
+        get_image = lambda: work_image
+        params = work_image
+    params.requires_grad_(True)
+
+    optimizer = optim.LBFGS([params], lr=LEARNING_RATE, max_iter=num_steps, **LBFGS_KWARGS)
+    loss_fn = FusedLoss(content_targets, style_targets, content_weight, style_weight, tv_weight)
 
     step = 0
+    losses = []
+    if resume is not None:
+        with torch.no_grad():
+            params.copy_(resume['params'])
+        optimizer.load_state_dict(resume['optimizer'])
+        step = resume['step']
+        losses = resume['losses']
 
     def get_loss_and_grad():
         nonlocal step
 
-        with torch.no_grad():
-            work_image.clamp_(0, 1)
-
-        model(work_image)
+        if not USE_FOURIER:
+            with torch.no_grad():
+                work_image.clamp_(0, 1)
 
-        content_loss = torch.stack([cl.loss for cl in content_losses]).sum() * content_weight
-        style_loss = torch.stack([sl.loss for sl in style_losses]).sum() * style_weight
-        tv_loss = (tv_loss_fn(work_image) * tv_weight) if tv_weight else torch.tensor(0)
-        loss = content_loss + style_loss + tv_loss
+        image = get_image()
+        content_features, style_features = extract_features(image, [CONTENT_LAYERS, STYLE_LAYERS])
+        loss_terms = loss_fn(image, content_features, style_features)
+        loss = loss_terms.sum()
 
         optimizer.zero_grad()
         loss.backward()
 
         step += 1
+        content_loss, style_loss, tv_loss = loss_terms.tolist()
 
-        if step % 50 == 0 or step in (1, NUM_STEPS):
-            logger.info('Step: %d/%d, content loss: %.2e, style loss: %.2e, tv loss: %.2e', step, NUM_STEPS,
-                content_loss.item(), style_loss.item(), tv_loss.item())
+        if step % 50 == 0 or step in (1, num_steps):
+            logger.info('Step: %d/%d, content loss: %.2e, style loss: %.2e, tv loss: %.2e', step, num_steps,
+                content_loss, style_loss, tv_loss)
+
+        losses.append(loss.item())
+        if callback is not None:
+            callback(step, content_loss=content_loss, style_loss=style_loss, tv_loss=tv_loss)
+        check_convergence(step, num_steps, losses, deadline)
 
         return loss
 
-    optimizer.step(get_loss_and_grad)
+    # with checkpoints, run l-bfgs in chunks, its state is only consistent between step calls; the chunks cost
+    # nothing extra, the evaluation at the start of a step call replaces the one skipped at the end of the last
+    chunk_steps = CHECKPOINT_STEPS if checkpoint is not None else num_steps
+    try:
+        while True:
+            n_iter = optimizer.state[params].get('n_iter', 0)
+            if n_iter >= num_steps:
+                stop_reason = 'max_steps'
+                break
+            max_iter = min(chunk_steps, num_steps - n_iter)
+            optimizer.param_groups[0].update(max_iter=max_iter, max_eval=max_iter * 5 // 4)
+            optimizer.step(get_loss_and_grad)
+            if optimizer.state[params]['n_iter'] - n_iter < max_iter:
+                stop_reason = 'tolerance'
+                break
+            if checkpoint is not None and optimizer.state[params]['n_iter'] < num_steps:
+                with torch.no_grad():
+                    image = get_image().detach().clone()
+                checkpoint({'image': image, 'params': params.detach().clone(), 'optimizer': optimizer.state_dict(),
+                    'step': step, 'losses': losses})
+                if checkpoints.drain.is_set():
+                    stop_reason = 'interrupted'
+                    break
+    except StopOptimization as e:
+        stop_reason = str(e)
+    logger.info('Stopped after %d steps: %s', step, stop_reason)
 
     with torch.no_grad():
-        work_image.clamp_(0, 1)
-
-    return work_image.detach()
-
-
-def style_transfer(content_image, style_image, strength):
+        work_image = get_image().clamp_(0, 1)
+
+    return work_image.detach(), step, stop_reason
+
+
+def run_style_transfer(content_image, style_targets, content_weight, style_weight, tv_weight, deadline=None,
+        progress=None, checkpoint_path=None):
+    schedule = list(zip(PYRAMID_SCALES, PYRAMID_STEPS)) if USE_PYRAMID else [(1, NUM_STEPS)]
+    max_steps = sum(num_steps for _, num_steps in schedule)
+    start_time = time.time()
+    work_image = None
+    total_steps = 0
+    stop_reason = None
+    start_stage = 0
+    resume = None
+
+    key = [list(content_image.shape), schedule, USE_FOURIER, content_weight, style_weight, tv_weight]
+    state = checkpoints.load(checkpoint_path, device) if checkpoint_path is not None else None
+    if state is not None and state['key'] == key:
+        start_stage, total_steps, resume = state['stage'], state['total_steps'], state['resume']
+        work_image = state['image']
+        logger.info('Resuming from step %d.', total_steps + (resume['step'] if resume is not None else 0))
+    elif state is not None:
+        logger.warning('Ignoring an incompatible checkpoint.')
+    start_steps = total_steps + (resume['step'] if resume is not None else 0)
+
+    def save_checkpoint(stage, state):
+        checkpoints.save(checkpoint_path, {'key': key, 'stage': stage, 'total_steps': total_steps,
+            'image': state.pop('image'), 'resume': state or None})
+
+    def callback(step, **losses):
+        cur_time = time.time()
+        step = min(total_steps + step, max_steps)
+        eta = (cur_time - start_time) / max(step - start_steps, 1) * (max_steps - step)
+        if deadline is not None:
+            eta = min(eta, max(deadline - cur_time, 0))
+        progress({'step': step, 'total_steps': max_steps, **losses, 'eta': round(eta)})
+    for stage, (scale, num_steps) in enumerate(schedule):
+        if stage < start_stage:
+            continue
+        if stop_reason == 'time_budget':
+            break
+        size = [min(max(round(s * scale), PYRAMID_MIN_SIZE), s) for s in content_image.shape[-2:]]
+        if work_image is None:
+            work_image = torch.rand([*content_image.shape[:-2], *size]) * NOISE[0] + NOISE[1]
+        else:
+            work_image = resize_image(work_image, size)
+        logger.info('Scale: %g, size: %dx%d', scale, size[1], size[0])
+        checkpoint = functools.partial(save_checkpoint, stage) if checkpoint_path is not None else None
+        work_image, steps, stop_reason = optimize(resize_image(content_image, size), style_targets, work_image,
+            num_steps, content_weight, style_weight, tv_weight, deadline, callback if progress is not None else None,
+            checkpoint, resume)
+        resume = None
+        total_steps += steps
+        if stop_reason == 'interrupted':
+            raise checkpoints.Interrupted(f'Interrupted after {total_steps} steps.')
+        if checkpoint is not None and stage < len(schedule) - 1:
+            save_checkpoint(stage + 1, {'image': work_image})
+            if checkpoints.drain.is_set():
+                raise checkpoints.Interrupted(f'Interrupted after {total_steps} steps.')
+    work_image = resize_image(work_image, list(content_image.shape[-2:]))
+    return work_image, {'steps': total_steps, 'stop_reason': stop_reason}
+
+
+def style_transfer(content_image, style_image, strength, time_budget=None, progress=None, checkpoint_path=None):
+    deadline = time.time() + time_budget if time_budget is not None else None
+    style_targets = get_cached_style_targets(style_image)
     content_image = convert_image(content_image).unsqueeze(0)
-    style_image = convert_image(style_image).unsqueeze(0)
     style_weight = MAX_STYLE_WEIGHT * strength / 100
-    output = run_style_transfer(content_image, style_image, CONTENT_WEIGHT, style_weight, TV_WEIGHT)
-    return to_image(output[0])
+    output, info = run_style_transfer(content_image, style_targets, CONTENT_WEIGHT, style_weight, TV_WEIGHT,
+        deadline, progress, checkpoint_path)
+    return to_image(output[0]), info
 
 
 last = -1
@@ -203,3 +511,4 @@ for i, (name, _) in enumerate(get_layers()):
     if name in CONTENT_LAYERS or name in STYLE_LAYERS:
         last = i
 cnn = cnn[:last + 1]
+extractor, feature_names = get_feature_extractor()
@@ -1,38 +1,67 @@
-from PIL import Image
+import time
 
-from . import fast, iterative
+from .images import load_image, save_image, get_image_size
 
 
 FAST_MAX_SIZE = 512
 ITER_MAX_SIZE = 400
 
 
-def load_image(image_path, max_size):
-    image = Image.open(image_path).convert('RGB')
-    size = image.size
-    long_edge = max(size)
-    if long_edge > max_size:
-        scale = max_size / long_edge
-        size = [max(round(s * scale), 1) for s in size]
-        image = image.resize(size, resample=Image.Resampling.BILINEAR)
-    return image
+batch_outputs = {}
 
 
-def save_image(image, result_path):
-    image.save(result_path)
-    return image.size
-
-
-def style_transfer(module, max_size, base_path, content_filename, style_filename, strength, result_filename):
+def style_transfer(module, max_size, base_path, content_filename, style_filename, strength, result_filename,
+        **kwargs):
+    start_time = time.time()
+    input_size = get_image_size(base_path / content_filename)
     content_image = load_image(base_path / content_filename, max_size)
     style_image = load_image(base_path / style_filename, max_size)
-    output = module.style_transfer(content_image, style_image, strength)
-    return save_image(output, base_path / result_filename)
+    load_time = time.time()
+    output, info = module.style_transfer(content_image, style_image, strength, **kwargs)
+    model_time = time.time()
+    size = save_image(output, base_path / result_filename)
+    timings = {'load': load_time - start_time, 'model': model_time - load_time, 'save': time.time() - model_time}
+    return {'size': size, **info, 'input_size': input_size, 'timings': timings}
+
+
+def fast_style_transfer_batch(jobs_args):
+    buckets = {}
+    for base_path, content_filename, style_filename, strength in jobs_args:
+        start_time = time.time()
+        try:
+            input_size = get_image_size(base_path / content_filename)
+            content_image = load_image(base_path / content_filename, FAST_MAX_SIZE)
+            style_image = load_image(base_path / style_filename, FAST_MAX_SIZE)
+        except OSError:
+            continue  # let the job fail on its own
+        key = base_path, content_filename, style_filename, strength
+        timings = {'load': time.time() - start_time}
+        buckets.setdefault(content_image.size, []).append((key, content_image, style_image, strength, input_size,
+            timings))
+    for bucket in buckets.values():
+        if len(bucket) < 2:
+            continue
+        keys, content_images, style_images, strengths, input_sizes, timings = zip(*bucket)
+        start_time = time.time()
+        from . import fast
+        outputs = fast.style_transfer_batch(content_images, style_images, strengths)
+        model_time = (time.time() - start_time) / len(bucket)
+        for key, output, input_size, job_timings in zip(keys, outputs, input_sizes, timings):
+            batch_outputs[key] = output, input_size, {**job_timings, 'model': model_time}
 
 
-def fast_style_transfer(*args, **kwargs):
-    return style_transfer(fast, FAST_MAX_SIZE, *args, **kwargs)
+def fast_style_transfer(base_path, content_filename, style_filename, strength, result_filename):
+    prefetched = batch_outputs.pop((base_path, content_filename, style_filename, strength), None)
+    if prefetched is not None:
+        output, input_size, timings = prefetched
+        start_time = time.time()
+        size = save_image(output, base_path / result_filename)
+        timings = {**timings, 'save': time.time() - start_time}
+        return {'size': size, 'input_size': input_size, 'timings': timings}
+    from . import fast
+    return style_transfer(fast, FAST_MAX_SIZE, base_path, content_filename, style_filename, strength, result_filename)
 
 
 def iterative_style_transfer(*args, **kwargs):
+    from . import iterative
     return style_transfer(iterative, ITER_MAX_SIZE, *args, **kwargs)
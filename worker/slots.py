@@ -0,0 +1,31 @@
+import os
+import sys
+
+
+def get_slot_cpus(slot, num_slots, cpus=None):
+    # contiguous shares, so that a slot's threads stay on neighbouring cores
+    cpus = sorted(cpus or os.sched_getaffinity(0))
+    size, extra = divmod(len(cpus), num_slots)
+    if size == 0:
+        return [cpus[slot % len(cpus)]]
+    start = slot * size + min(slot, extra)
+    return cpus[start:start + size + (slot < extra)]
+
+
+def pin(cpus):
+    os.sched_setaffinity(0, cpus)
+    num_threads = str(len(cpus))
+    # for libraries initialized later in this process
+    for name in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS']:
+        os.environ[name] = num_threads
+    if 'torch' in sys.modules:
+        import torch
+        torch.set_num_threads(len(cpus))
+
+
+def preload():
+    # load the iterative model before forking the slots, so that its weights are shared copy-on-write;
+    # tensorflow isn't fork-safe, so each slot loads the fast model itself
+    import torch
+    torch.set_num_threads(1)  # an OpenMP thread pool in the parent would not survive the fork
+    import worker.iterative
@@ -14,24 +14,49 @@ import docker
 import numpy as np
 from PIL import Image
 from redis import Redis
-from rq import Queue
+from rq import Queue, Retry, get_current_job
+from rq.timeouts import JobTimeoutException
 
-from common import NAME, config, database, history
+from common import NAME, config, database, history, results, expiry, scheduling
+from . import checkpoints
 
 
 DATA_DIR = Path(__file__).parent.parent / 'data'
 JOBS_DIR = DATA_DIR / config.JOBS_DIR
+ITER_TIME_BUDGET = 0.9  # fraction of the job timeout
+PROGRESS_INTERVAL = 5
+
+pending_batch = []  # the args of the batch that the next fast job runs, see conf/worker.py
 
 
 logger = logging.getLogger(__name__)
 
 
-def style_transfer(func, subdir, content_filename, style_filename, strength, result_filename, with_history=True):
+def get_progress_callback(job):
+    last_time = 0.0
+
+    def callback(progress):
+        nonlocal last_time
+        cur_time = time.time()
+        if cur_time - last_time < PROGRESS_INTERVAL:
+            return
+        job.meta['progress'] = progress
+        job.save_meta()  # triggers a keyspace notification for websocket listeners
+        last_time = cur_time
+
+    return callback
+
+
+def style_transfer(func, subdir, content_filename, style_filename, strength, result_filename, with_history=True,
+        **kwargs):
     succeeded = False
+    interrupted = False
     base_path = JOBS_DIR / subdir
+    job = get_current_job()
 
     db = None
     hist_id = None
+    result = None
     if with_history:
         db = database.connect(DATA_DIR / config.DATABASE)
 
@@ -40,45 +65,130 @@ def style_transfer(func, subdir, content_filename, style_filename, strength, res
             hist_id = history.start_job(db, meta=func.__name__)
 
         start_time = time.time()
-        result = func(base_path, content_filename, style_filename, strength, result_filename)
+        result = func(base_path, content_filename, style_filename, strength, result_filename, **kwargs)
         logger.info('Finished in %.1f seconds.', time.time() - start_time)
         succeeded = True
+        if job is not None and 'result_key' in job.meta and job.result_ttl and job.result_ttl > 0:
+            results.register(redis_client, job.meta['result_key'], f'{subdir}/{result_filename}', job.result_ttl)
         return result
 
+    except checkpoints.Interrupted:
+        # keep the inputs and the checkpoint, and let the worker requeue the job as a retry
+        interrupted = True
+        if job is not None:
+            job.retries_left = (job.retries_left or 0) + 1
+            job_kwargs = {'job_timeout': job.timeout, 'ttl': job.ttl, 'result_ttl': job.result_ttl,
+                'retry': Retry(max=job.retries_left)}
+            expiry.schedule(redis_client, subdir, expiry.get_max_ttl(job_kwargs))
+        raise
+
+    except Exception:
+        # the retries are for crashes, which never get here
+        if job is not None:
+            job.retries_left = 0
+        raise
+
     finally:
         if db is not None:
             try:
                 if hist_id is not None:
-                    history.end_job(db, hist_id, succeeded)
+                    if interrupted:
+                        history.cancel_job(db, hist_id)  # the resumed job gets its own entry
+                    else:
+                        if succeeded:
+                            queue_time = None
+                            if job is not None and job.enqueued_at and job.started_at:
+                                queue_time = (job.started_at - job.enqueued_at).total_seconds()
+                            history.record_timing(db, hist_id, queue_time, result['timings'], result['input_size'],
+                                result['size'])
+                        history.end_job(db, hist_id, succeeded)
+            except Exception as e:
+                # the history is best-effort, it must not fail a finished job
+                logger.error('Failed to record job history: %s', e)
             finally:
                 db.close()
-        for path in [base_path / filename for filename in [content_filename, style_filename]]:
-            try:
-                path.unlink(missing_ok=True)
-            except OSError as e:
-                logger.error('Failed to remove %s: %s', path, e)
-                continue
+        if not interrupted:
+            for path in [base_path / filename for filename in [content_filename, style_filename, checkpoints.FILENAME]]:
+                try:
+                    path.unlink(missing_ok=True)
+                except OSError as e:
+                    logger.error('Failed to remove %s: %s', path, e)
+                    continue
+            if job is not None:
+                scheduling.Queue(job.origin, connection=redis_client).unregister_job(job.id)
+                ttl = job.result_ttl if succeeded else job.failure_ttl
+                if ttl is not None and ttl >= 0:
+                    expiry.schedule(redis_client, subdir, ttl)
+        from .cache import publish_stats
+        publish_stats(redis_client)
 
 
 def fast_style_transfer(*args, **kwargs):
     from . import models
+    if pending_batch:
+        jobs_args = pending_batch.copy()
+        pending_batch.clear()
+        try:
+            prefetch_fast_style_transfer(jobs_args)
+        except JobTimeoutException:
+            raise
+        except Exception:
+            logger.exception('Batch failed, running jobs individually.')
     return style_transfer(models.fast_style_transfer, *args, **kwargs)
 
 
 def iterative_style_transfer(*args, **kwargs):
     from . import models
+    job = get_current_job()
+    if job is not None:
+        if job.timeout:
+            kwargs['time_budget'] = job.timeout * ITER_TIME_BUDGET
+        kwargs['progress'] = get_progress_callback(job)
+        kwargs['checkpoint_path'] = JOBS_DIR / args[0] / checkpoints.FILENAME  # a re-run of the job resumes from it
     return style_transfer(models.iterative_style_transfer, *args, **kwargs)
 
 
+def prefetch_fast_style_transfer(jobs_args):
+    from . import models
+    start_time = time.time()
+    models.fast_style_transfer_batch([(JOBS_DIR / args[0], *args[1:4]) for args in jobs_args])
+    logger.info('Prefetched %d of %d jobs in %.1f seconds.', len(models.batch_outputs), len(jobs_args),
+        time.time() - start_time)
+
+
+def clear_prefetched():
+    from . import models
+    models.batch_outputs.clear()
+
+
 def log_stats():
-    default_queue_len = len(Queue(name=config.DEFAULT_QUEUE, connection=redis_client))
-    system_queue_len = len(Queue(name=config.SYSTEM_QUEUE, connection=redis_client))
-    logger.info('Queues: %d default, %d system.', default_queue_len, system_queue_len)
+    fast_queue_len, iterative_queue_len, system_queue_len = [len(Queue(name=name, connection=redis_client))
+        for name in [config.FAST_QUEUE, config.ITERATIVE_QUEUE, config.SYSTEM_QUEUE]]
+    logger.info('Queues: %d fast, %d iterative, %d system.', fast_queue_len, iterative_queue_len, system_queue_len)
+    from .cache import get_stats
+    for name, stats in sorted(get_stats(redis_client).items()):
+        logger.info('Cache %s: %d hits, %d misses, %d entries in %d workers.', name, stats['hits'], stats['misses'],
+            stats['entries'], stats['workers'])
+
+
+def cleanup_data():
+    n_dirs = 0
+    for name in expiry.get_expired(redis_client):
+        try:
+            shutil.rmtree(JOBS_DIR / name)
+            n_dirs += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error('Failed to remove job directory %s: %s', name, e)
+            continue
+        expiry.remove(redis_client, name)
+    logger.info('Removed %d expired job directories.', n_dirs)
 
 
-def cleanup_data(job_kwargs):
-    ttl = sum(job_kwargs[k] for k in ['job_timeout', 'result_ttl', 'ttl'])
-    max_time = (datetime.now() - timedelta(seconds=ttl)).timestamp()
+def reconcile_data(job_kwargs):
+    # slow full scan for files missing from the expiry index
+    max_time = (datetime.now() - timedelta(seconds=expiry.get_max_ttl(job_kwargs))).timestamp()
     n_files, n_dirs = 0, 0
     jobs_dir = os.path.normpath(JOBS_DIR)
     for dirpath, dirnames, filenames in os.walk(jobs_dir, topdown=False):
@@ -133,11 +243,12 @@ def health_check():
     filename = 'test.png'
     job_id = f'test-{uuid.uuid4().hex}'
     job_dir = JOBS_DIR / job_id
+    expiry.schedule(redis_client, job_id, config.HEALTH_CHECK_VALIDITY)
     job_dir.mkdir(parents=True, exist_ok=True)
     with open(job_dir / filename, 'wb') as f:
         test_image.seek(0)
         shutil.copyfileobj(test_image, f)
-    queue = Queue(name=config.DEFAULT_QUEUE, connection=redis_client)
+    queue = Queue(name=config.FAST_QUEUE, connection=redis_client)
     args = job_id, filename, filename, 100, 'result.png'
     kwargs = {'with_history': False}
     job_id = config.IMAGE_CHECK_JOB_ID  # if re-enqueuing with the same id causes problems, use the uuid and return it
@@ -152,6 +263,7 @@ def maintenance():
     try:
         n_deleted = history.cleanup(db)
         logger.info('Deleted %d old job history entries.', n_deleted)
+        history.rebuild_job_stats(db)  # reconcile the rollup, e.g. after an upgrade or a manual edit
     finally:
         db.close()
 
@@ -1,16 +1,32 @@
 import os
+import hashlib
 from pathlib import Path
 
 
-def get_vgg_model():
+HUB_MODEL_URL = 'https://tfhub.dev/google/magenta/arbitrary-image-stylization-v1-256/2'
+HUB_CACHE_DIR = Path.home() / '.cache' / 'tfhub'
+
+
+def get_vgg_model(pretrained=True):
     from torchvision.models import vgg19, VGG19_Weights
-    return vgg19(weights=VGG19_Weights.IMAGENET1K_V1)
+    return vgg19(weights=VGG19_Weights.IMAGENET1K_V1 if pretrained else None)
 
 
 def get_hub_model():
     import tensorflow_hub as hub
-    os.environ['TFHUB_CACHE_DIR'] = str(Path.home() / '.cache' / 'tfhub')
-    return hub.load('https://tfhub.dev/google/magenta/arbitrary-image-stylization-v1-256/2')
+    os.environ['TFHUB_CACHE_DIR'] = str(HUB_CACHE_DIR)
+    return hub.load(HUB_MODEL_URL)
+
+
+def is_vgg_model_cached():
+    import torch
+    from torchvision.models import VGG19_Weights
+    filename = os.path.basename(VGG19_Weights.IMAGENET1K_V1.url)
+    return (Path(torch.hub.get_dir()) / 'checkpoints' / filename).exists()
+
+
+def is_hub_model_cached():
+    return (HUB_CACHE_DIR / hashlib.sha1(HUB_MODEL_URL.encode()).hexdigest()).is_dir()
 
 
 def download_all():